@@ -0,0 +1,41 @@
+"""Add indexes for the scheduling and playback queries
+
+Revision ID: 0c7d3e95a8f1
+Revises: b81e4a7f3c25
+Create Date: 2026-10-18 18:31:05.227604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0c7d3e95a8f1"
+down_revision = "b81e4a7f3c25"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # overlap check in create_playlist
+    op.create_index(
+        "ix_playlist_queue_approved_timeslot",
+        "playlist",
+        ["queue", "approved", "timeslot_start", "timeslot_end"],
+    )
+    # index view and the schedule index in next_track
+    op.create_index("ix_playlist_timeslot_end", "playlist", ["timeslot_end"])
+    # tracks from expired leases in next_track and next_tracks
+    op.create_index(
+        "ix_queued_track_playlist_id_played_lease_expires",
+        "queued_track",
+        ["playlist_id", "played", "lease_expires"],
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_queued_track_playlist_id_played_lease_expires", table_name="queued_track"
+    )
+    op.drop_index("ix_playlist_timeslot_end", table_name="playlist")
+    op.drop_index("ix_playlist_queue_approved_timeslot", table_name="playlist")
@@ -0,0 +1,30 @@
+"""Add lease columns to QueuedTrack
+
+Revision ID: 5d2f0c9a61b4
+Revises: 8943190072c0
+Create Date: 2026-10-18 17:40:12.304918
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5d2f0c9a61b4"
+down_revision = "8943190072c0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "queued_track", sa.Column("lease_token", sa.Unicode(length=32), nullable=True)
+    )
+    op.add_column(
+        "queued_track", sa.Column("lease_expires", sa.DateTime(), nullable=True)
+    )
+
+
+def downgrade():
+    op.drop_column("queued_track", "lease_expires")
+    op.drop_column("queued_track", "lease_token")
@@ -0,0 +1,41 @@
+"""Add track metadata cache
+
+Revision ID: 6a1e3d8c2b47
+Revises: 0c7d3e95a8f1
+Create Date: 2026-10-18 19:12:44.018316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "6a1e3d8c2b47"
+down_revision = "0c7d3e95a8f1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "track_metadata",
+        sa.Column("url", sa.Unicode(length=2048), nullable=False),
+        sa.Column("artist", sa.UnicodeText(), nullable=True),
+        sa.Column("title", sa.UnicodeText(), nullable=True),
+        sa.Column("album", sa.UnicodeText(), nullable=True),
+        sa.Column("label", sa.UnicodeText(), nullable=True),
+        sa.Column("bitrate", sa.Integer(), nullable=True),
+        sa.Column("sample", sa.Integer(), nullable=True),
+        sa.Column("length", sa.Integer(), nullable=True),
+        sa.Column("etag", sa.Unicode(length=255), nullable=True),
+        sa.Column("last_modified", sa.Unicode(length=64), nullable=True),
+        sa.Column("fetched", sa.DateTime(), nullable=False),
+        sa.Column("last_used", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("url"),
+    )
+    op.create_index("ix_track_metadata_last_used", "track_metadata", ["last_used"])
+
+
+def downgrade():
+    op.drop_index("ix_track_metadata_last_used", table_name="track_metadata")
+    op.drop_table("track_metadata")
@@ -0,0 +1,86 @@
+"""Add QueuedTrack.position and Playlist.cursor
+
+Revision ID: b81e4a7f3c25
+Revises: 5d2f0c9a61b4
+Create Date: 2026-10-18 18:02:47.911532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b81e4a7f3c25"
+down_revision = "5d2f0c9a61b4"
+branch_labels = None
+depends_on = None
+
+
+queued_track = sa.table(
+    "queued_track",
+    sa.column("id", sa.Integer),
+    sa.column("playlist_id", sa.Integer),
+    sa.column("position", sa.Integer),
+    sa.column("played", sa.Boolean),
+    sa.column("lease_token", sa.Unicode),
+)
+
+playlist = sa.table(
+    "playlist",
+    sa.column("id", sa.Integer),
+    sa.column("cursor", sa.Integer),
+)
+
+
+def upgrade():
+    op.add_column("queued_track", sa.Column("position", sa.Integer(), nullable=True))
+    op.add_column(
+        "playlist",
+        sa.Column("cursor", sa.Integer(), server_default="0", nullable=False),
+    )
+
+    # Tracks used to be played in order of ID, so number them that way
+    earlier = queued_track.alias("earlier")
+    op.execute(
+        queued_track.update().values(
+            position=sa.select(sa.func.count(earlier.c.id))
+            .where(
+                earlier.c.playlist_id == queued_track.c.playlist_id,
+                earlier.c.id < queued_track.c.id,
+            )
+            .scalar_subquery()
+        )
+    )
+
+    # Everything up to the last track that was played or leased has been
+    # handed out already
+    op.execute(
+        playlist.update().values(
+            cursor=sa.select(
+                sa.func.coalesce(sa.func.max(queued_track.c.position) + 1, 0)
+            )
+            .where(
+                queued_track.c.playlist_id == playlist.c.id,
+                sa.or_(
+                    queued_track.c.played == True,
+                    queued_track.c.lease_token != None,
+                ),
+            )
+            .scalar_subquery()
+        )
+    )
+
+    op.alter_column(
+        "queued_track", "position", existing_type=sa.Integer(), nullable=False
+    )
+    op.create_index(
+        "ix_queued_track_playlist_id_position",
+        "queued_track",
+        ["playlist_id", "position"],
+    )
+
+
+def downgrade():
+    op.drop_index("ix_queued_track_playlist_id_position", table_name="queued_track")
+    op.drop_column("playlist", "cursor")
+    op.drop_column("queued_track", "position")
@@ -0,0 +1,30 @@
+"""Add song catalog generation
+
+Revision ID: b84f2c6d1e93
+Revises: 6a1e3d8c2b47
+Create Date: 2026-10-18 21:03:17.552941
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b84f2c6d1e93"
+down_revision = "6a1e3d8c2b47"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "song_catalog",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("generation", sa.Integer(), nullable=False),
+        sa.Column("updated", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+
+def downgrade():
+    op.drop_table("song_catalog")
@@ -1,68 +1,227 @@
+import codecs
 import datetime
 import elasticsearch
-import mutagen
-import requests
-import tempfile
+import itertools
+import json
+import os
+import time
 import urllib.parse
-from flask import Blueprint, jsonify, make_response, request
+from flask import (
+    abort,
+    Blueprint,
+    current_app,
+    jsonify,
+    make_response,
+    request,
+    Response,
+    send_file,
+    stream_with_context,
+    url_for,
+)
+from .audio_cache import audio_cache
 from .db import db
 from .es import es
 from .exceptions import PlaylistValidationException
-from .models import QueuedTrack, Playlist
-from .view_utils import require_auth, get_file_url, process_url
+from .liquidsoap import LiquidsoapURI
+from .metadata import get_track_metadata, get_tracks_metadata, metadata_cache
+from .models import Playlist, QueuedTrack
+from .playlist_files import parse_playlist
+from .schedule import schedule
+from .search import no_results, parse_search_args, search_songs
+from .search_cache import search_cache
+from .track_queue import (
+    claim_next_track,
+    confirm_leased_track,
+    lease_tracks,
+    release_lease,
+    update_tracks,
+)
+from .url_check import url_checker
+from .view_utils import (
+    require_auth,
+    get_file_url,
+    map_by_host,
+    process_url,
+    try_process_url,
+)
 
 
 bp = Blueprint("pload_api_v1", __name__)
 
 output_content_type = "text/plain; charset=utf-8"
 
+# number of tracks validated at a time during an import
+import_batch_size = 50
 
-@bp.route("/next_track")
-@require_auth
-def next_track():
-    now = datetime.datetime.utcnow()
 
+def get_requested_queue():
     # prerecorded playlists contain station IDs, PSAs, promos, etc. as part of
     # the playlist already
     if request.args.get("prerecorded") == "1":
-        queue = "prerecorded"
+        return "prerecorded"
     else:
-        queue = "default"
-
-    playlist = Playlist.query.filter(
-        Playlist.timeslot_start <= now,
-        Playlist.timeslot_end > now,
-        Playlist.queue == queue,
-        Playlist.approved != None,
-    ).first()
-    if playlist is not None:
-        next_track = (
-            QueuedTrack.query.filter(
-                QueuedTrack.playlist_id == playlist.id,
-                QueuedTrack.played == False,
+        return "default"
+
+
+def annotate_dj(uri, dj_id):
+    if dj_id is not None and dj_id > 1:
+        uri.annotate("trackman_dj_id", "{0:d}".format(dj_id))
+    return uri
+
+
+def playback_url(url, dj_id):
+    """The URL to hand to the player: served from the local audio cache if we
+    have the file, and annotated with the DJ to log the track under."""
+    uri = LiquidsoapURI.parse(url)
+
+    if audio_cache.enabled:
+        key = audio_cache.lookup(get_file_url(url))
+        if key is not None:
+            # the player only has the URL to go on, so it carries a token
+            # that expires rather than the API credentials
+            uri.url = url_for(
+                "pload_api_v1.cached_track",
+                key=key,
+                token=audio_cache.token_for(key),
+                _external=True,
             )
-            .order_by(QueuedTrack.id)
-            .first()
-        )
 
-        if next_track is not None:
-            next_track.played = True
-            db.session.commit()
+    return str(annotate_dj(uri, dj_id))
 
-            url = next_track.url
-            if playlist.dj_id is not None and playlist.dj_id > 1:
-                url = "annotate:trackman_dj_id={dj_id:d}:{url}".format(
-                    dj_id=playlist.dj_id, url=url
-                )
 
-            resp = make_response("{0}\n".format(url))
-            resp.headers["Content-Type"] = output_content_type
-            return resp
+def get_requested_wait():
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        wait = 0
+    return max(0, min(wait, current_app.config["NEXT_TRACK_MAX_WAIT"]))
+
+
+@bp.route("/next_track")
+@require_auth
+def next_track():
+    queue = get_requested_queue()
+
+    # with wait set, hold the request open until a track is available (a
+    # playlist starts or tracks are added to it) rather than returning 404
+    # and having the player poll again
+    deadline = time.monotonic() + get_requested_wait()
+
+    while True:
+        now = datetime.datetime.utcnow()
+
+        playlist = schedule.current(queue, now)
+        if playlist is not None:
+            url = claim_next_track(playlist.id)
+
+            if url is not None:
+                url = playback_url(url, playlist.dj_id)
+
+                resp = make_response("{0}\n".format(url))
+                resp.headers["Content-Type"] = output_content_type
+                return resp
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        schedule.wait(
+            queue,
+            now,
+            min(remaining, current_app.config["NEXT_TRACK_RECHECK_INTERVAL"]),
+        )
 
     # if we made it here, we've run out of songs in the playlist
     return "", 404, {"Content-Type": output_content_type}
 
 
+@bp.route("/next_tracks")
+@require_auth
+def next_tracks():
+    """Lease the next n tracks so the player can prefetch them. Leased tracks
+    are skipped by other pollers until they are confirmed as played with
+    /confirm_track, released with /release_tracks, or the lease expires."""
+    now = datetime.datetime.utcnow()
+
+    try:
+        count = int(request.args.get("n", 1))
+    except ValueError:
+        count = 0
+    if count < 1 or count > current_app.config["NEXT_TRACKS_MAX"]:
+        return jsonify({"success": False, "message": "Invalid value for n."}), 400
+
+    playlist = schedule.current(get_requested_queue(), now)
+    if playlist is not None:
+        token, expires, tracks = lease_tracks(
+            playlist.id, count, current_app.config["TRACK_LEASE_TIME"]
+        )
+
+        if len(tracks) > 0:
+            return jsonify(
+                {
+                    "success": True,
+                    "lease": token,
+                    "expires": expires,
+                    "tracks": [
+                        {"id": track_id, "url": playback_url(url, playlist.dj_id)}
+                        for track_id, url in tracks
+                    ],
+                }
+            )
+
+    return jsonify({"success": False, "tracks": []}), 404
+
+
+@bp.route("/confirm_track")
+@require_auth
+def confirm_track():
+    try:
+        track_id = int(request.args["id"])
+    except (KeyError, ValueError):
+        return jsonify({"success": False, "message": "Invalid track ID."}), 400
+
+    if confirm_leased_track(request.args.get("lease", ""), track_id):
+        return jsonify({"success": True})
+    else:
+        return (
+            jsonify(
+                {
+                    "success": False,
+                    "message": "That track is not held by this lease.",
+                }
+            ),
+            404,
+        )
+
+
+@bp.route("/release_tracks")
+@require_auth
+def release_tracks():
+    released = release_lease(request.args.get("lease", ""))
+    return jsonify({"success": True, "released": released})
+
+
+@bp.route("/cached/<key>")
+def cached_track(key):
+    if not audio_cache.enabled:
+        abort(404)
+
+    if not audio_cache.check_token(key, request.args.get("token", "")):
+        abort(403)
+
+    try:
+        path = audio_cache.path_for(key)
+    except ValueError:
+        abort(404)
+
+    if not os.path.exists(path):
+        abort(404)
+
+    audio_cache.touch(key)
+    # conditional responses include support for Range requests
+    return send_file(path, conditional=True, max_age=3600)
+
+
 @bp.route("/underwriting")
 @require_auth
 def underwriting():
@@ -70,6 +229,20 @@ def underwriting():
     return "", 404, {"Content-Type": output_content_type}
 
 
+@bp.route("/cache_stats")
+@require_auth
+def cache_stats():
+    """Hit and miss counts for this worker's caches, for sizing them."""
+    return jsonify(
+        {
+            "success": True,
+            "metadata": metadata_cache.stats(),
+            "url_check": url_checker.cache.stats(),
+            "search": search_cache.stats(),
+        }
+    )
+
+
 @bp.route("/validate_track")
 def validate_track():
     try:
@@ -83,73 +256,253 @@ def validate_track():
         }
 
         if not request.args.get("skip_metadata"):
-            file_url = get_file_url(url)
-
-            try:
-                results = es.search(
-                    body={
-                        "query": {
-                            "match": {
-                                "url": file_url,
-                            }
-                        }
-                    }
-                )
-                if results is not None and len(results["hits"]) > 0:
-                    for item in results["hits"]["hits"]:
-                        # need to make sure URL is an exact match
-                        if item["_source"]["url"] == url:
-                            for k, v in item["_source"].items():
-                                if k != "url":
-                                    result[k] = v
-                            return jsonify(result)
-            except (
-                elasticsearch.ImproperlyConfigured,
-                elasticsearch.ElasticsearchException,
-                elasticsearch.exceptions.RequestError,
+            result.update(get_track_metadata(url))
+
+        return jsonify(result)
+
+
+@bp.route("/validate_tracks", methods=["POST"])
+def validate_tracks():
+    """Validate a list of track URLs at once, checking several concurrently.
+    Results are returned in the same order, in the same shape as the results
+    from saving a playlist, with metadata added unless skip_metadata is set."""
+    if request.headers.get("X-Requested-With") is None:
+        abort(400)
+
+    urls = request.form.getlist("urls[]")
+    skip_metadata = request.form.get("skip_metadata")
+
+    results = []
+    for index, (url, processed) in enumerate(
+        zip(urls, map_by_host(try_process_url, urls))
+    ):
+        if processed is None:
+            results.append({"index": index + 1, "url": url, "status": "Error"})
+        else:
+            results.append({"index": index + 1, "url": processed, "status": "OK"})
+
+    if not skip_metadata:
+        valid = [result for result in results if result["status"] == "OK"]
+        metadata = get_tracks_metadata([result["url"] for result in valid])
+        for result, track_metadata in zip(valid, metadata):
+            result.update(track_metadata)
+
+    return jsonify(
+        {
+            "success": all(result["status"] == "OK" for result in results),
+            "results": results,
+        }
+    )
+
+
+@bp.route("/playlists/<int:playlist_id>/metadata", methods=["POST"])
+def playlist_metadata(playlist_id):
+    """Look up metadata for tracks in a playlist, given by their IDs, several
+    at a time. Only the URLs stored for the playlist are looked up, so nothing
+    else is ever fetched or cached."""
+    if request.headers.get("X-Requested-With") is None:
+        abort(400)
+
+    try:
+        track_ids = [int(track_id) for track_id in request.form.getlist("ids[]")]
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid track ID."}), 400
+
+    rows = db.session.execute(
+        db.select(QueuedTrack.id, QueuedTrack.url).where(
+            QueuedTrack.playlist_id == playlist_id, QueuedTrack.id.in_(track_ids)
+        )
+    ).all()
+    metadata = get_tracks_metadata([row.url for row in rows])
+
+    return jsonify(
+        {
+            "success": True,
+            "tracks": [
+                dict(track_metadata, track_id=row.id)
+                for row, track_metadata in zip(rows, metadata)
+            ],
+        }
+    )
+
+
+@bp.route("/playlists/<int:playlist_id>/import", methods=["POST"])
+def import_playlist(playlist_id):
+    """Append the tracks in an uploaded M3U, M3U8 or PLS file to a playlist.
+    Progress and failed entries are streamed back as newline-delimited JSON
+    events, ending with a done event. The tracks are only added if every one
+    of them passes validation."""
+    if request.headers.get("X-Requested-With") is None:
+        abort(400)
+
+    Playlist.query.get_or_404(playlist_id)
+
+    upload = request.files.get("file")
+    if upload is None:
+        abort(400)
+
+    entries = parse_playlist(
+        codecs.iterdecode(upload.stream, "utf-8", errors="replace"),
+        upload.filename or "",
+    )
+
+    def event(name, **data):
+        return json.dumps({"event": name, **data}) + "\n"
+
+    def generate():
+        valid = []
+        failed = 0
+        validated = 0
+
+        while True:
+            batch = list(itertools.islice(entries, import_batch_size))
+            if len(batch) <= 0:
+                break
+
+            for entry, url in zip(
+                batch, map_by_host(try_process_url, [entry.url for entry in batch])
             ):
-                pass
-
-            ext = file_url.rsplit(".", 1)[-1]
-
-            with tempfile.NamedTemporaryFile(suffix="." + ext) as f:
-                try:
-                    r = requests.get(file_url, stream=True)
-                    r.raise_for_status()
-                except requests.exceptions.RequestException:
-                    return jsonify(result)
-
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-                f.seek(0, 0)
-
-                try:
-                    m = mutagen.File(f, easy=True)
-                except mutagen.MutagenError:
-                    pass
+                if url is None:
+                    failed += 1
+                    yield event("error", line=entry.line, url=entry.url)
                 else:
-                    if m is not None:
-                        tags_to_copy = ("artist", "title", "album", "label")
-                        for tag in tags_to_copy:
-                            if m.get(tag) is not None and len(m.get(tag)) > 0:
-                                result[tag] = m[tag][0]
-
-                        try:
-                            result.update(
-                                {
-                                    "bitrate": m.info.bitrate // 1000,
-                                    "sample": m.info.sample_rate,
-                                    "length": int(m.info.length),
-                                }
-                            )
-                        except AttributeError:
-                            pass
+                    valid.append((entry, url))
 
-        return jsonify(result)
+            validated += len(batch)
+            yield event("progress", validated=validated, failed=failed)
+
+        if failed > 0:
+            yield event(
+                "done",
+                success=False,
+                message="{0:d} tracks failed to validate, so nothing was "
+                "imported.".format(failed),
+            )
+            return
+
+        # the row lock keeps concurrent imports and pollers out until the new
+        # tracks are in place
+        cursor = db.session.execute(
+            db.select(Playlist.cursor)
+            .where(Playlist.id == playlist_id)
+            .with_for_update()
+        ).scalar()
+        if cursor > 0:
+            db.session.rollback()
+            yield event(
+                "done",
+                success=False,
+                message="One or more tracks have already been played.",
+            )
+            return
+
+        start = db.session.execute(
+            db.select(db.func.coalesce(db.func.max(QueuedTrack.position) + 1, 0)).where(
+                QueuedTrack.playlist_id == playlist_id
+            )
+        ).scalar()
+        update_tracks(
+            playlist_id,
+            [],
+            [],
+            [(url, start + index) for index, (_, url) in enumerate(valid)],
+        )
+        track_ids = (
+            db.session.execute(
+                db.select(QueuedTrack.id)
+                .where(
+                    QueuedTrack.playlist_id == playlist_id,
+                    QueuedTrack.position >= start,
+                )
+                .order_by(QueuedTrack.position)
+            )
+            .scalars()
+            .all()
+        )
+        db.session.commit()
+        schedule.notify()
+
+        tracks = []
+        metadata = get_tracks_metadata([url for _, url in valid])
+        for track_id, (entry, url), track_metadata in zip(track_ids, valid, metadata):
+            track = {"track_id": track_id, "url": url}
+            # fall back to what the playlist file said about the track
+            if entry.title is not None:
+                track["title"] = entry.title
+            if entry.length is not None:
+                track["length"] = entry.length
+            track.update(track_metadata)
+            tracks.append(track)
+
+        yield event("done", success=True, tracks=tracks)
+
+    return Response(
+        stream_with_context(generate()),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
 
 
 @bp.route("/search")
 def search():
-    results = es.search(q=request.args["q"])
-    return jsonify(results["hits"])
+    """Search for tracks one page at a time; pass back the next value of the
+    response as search_after to get the following page. With format=compact,
+    each track is an array of the fields listed in the response. Results can
+    be sorted by, and filtered to exact values of, artist, album and label,
+    and sorted by title."""
+    try:
+        params = parse_search_args(
+            request.args,
+            current_app.config["SEARCH_PAGE_SIZE"],
+            current_app.config["SEARCH_MAX_PAGE_SIZE"],
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    key = search_cache.key(params)
+    result = search_cache.get(key)
+    if result is None:
+        try:
+            result = search_songs(params)
+        except elasticsearch.TransportError as e:
+            # e.g. the index is missing, or was mapped by an old import; this
+            # is not cached, so results come back as soon as it is fixed
+            current_app.logger.warning("Search failed: {0}".format(e))
+            return jsonify(no_results(params))
+        search_cache.set(key, result)
+    return jsonify(result)
+
+
+@bp.route("/suggest")
+def suggest():
+    """Suggest tracks whose artist, title or album has a word that starts
+    with the query, quickly enough to run as the user types."""
+    prefix = request.args.get("q", "").strip()
+    if len(prefix) == 0:
+        return jsonify({"tracks": []})
+
+    try:
+        results = es.search(
+            index=es.songs_index,
+            body={
+                "_source": ["artist", "title", "album", "label", "length", "url"],
+                "suggest": {
+                    "tracks": {
+                        "prefix": prefix,
+                        "completion": {
+                            "field": "suggest",
+                            "size": current_app.config["SEARCH_SUGGEST_SIZE"],
+                        },
+                    },
+                },
+            },
+        )
+    except elasticsearch.RequestError:
+        # the index was built before it had suggestions
+        return jsonify({"tracks": []})
+    except elasticsearch.TransportError as e:
+        # suggestions are a nicety, so carry on without them
+        current_app.logger.warning("Suggest failed: {0}".format(e))
+        return jsonify({"tracks": []})
+
+    options = results["suggest"]["tracks"][0]["options"]
+    return jsonify({"tracks": [option["_source"] for option in options]})
@@ -1,13 +1,20 @@
 import base64
 import click
-import json
 import os
+import time
 import urllib.parse
-import uuid
 from flask import Flask
 from .views import bp
+from .audio_cache import audio_cache
 from .db import db, init_db, migrate
 from .es import es
+from .exceptions import AudioCacheFullException
+from .http_session import http_session
+from .metadata import metadata_cache
+from .rewrite import display_url_rewriter, file_url_rewriter
+from .schedule import schedule
+from .search_cache import search_cache
+from .url_check import url_checker
 
 
 def generate_nonce():
@@ -82,6 +89,14 @@ def setup_app(app):
     db.init_app(app)
     migrate.init_app(app, db)
     es.init_app(app)
+    file_url_rewriter.init_app(app)
+    display_url_rewriter.init_app(app)
+    http_session.init_app(app)
+    url_checker.init_app(app)
+    metadata_cache.init_app(app)
+    search_cache.init_app(app)
+    schedule.init_app(app)
+    audio_cache.init_app(app)
 
     if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite://"):
         with app.app_context():
@@ -104,46 +119,157 @@ def initdb():
 
 
 @app.cli.command()
-@click.option("--json-path", required=True)
-def import_songs(json_path):
-    from elasticsearch.helpers import streaming_bulk
-
-    required_keys = ["artist", "title", "album", "label", "url"]
-
-    def generate_actions(json_path):
-        data = json.load(open(json_path))
-        for entry in data:
-            for k in required_keys:
-                if entry.get(k) is None:
-                    raise Exception(
-                        "Malformed songs JSON; missing required key {0}".format(k)
-                    )
+@click.option(
+    "--interval",
+    type=int,
+    default=0,
+    help="Keep running, checking for upcoming tracks every this many seconds.",
+)
+def prefetch_audio(interval):
+    """Download the tracks of upcoming playlists into the audio cache."""
+    from .audio_cache import upcoming_file_urls
+
+    if not audio_cache.enabled:
+        raise click.ClickException("AUDIO_CACHE_DIR is not set")
+
+    while True:
+        with app.app_context():
+            fetched = 0
+            failed = 0
+            file_urls = list(
+                upcoming_file_urls(app.config["AUDIO_CACHE_PREFETCH_MINUTES"])
+            )
+            # never push out a track that is coming up to make room for another
+            pinned = {audio_cache.key_for(file_url) for file_url in file_urls}
+            for file_url in file_urls:
+                try:
+                    cached = audio_cache.fetch(file_url, pinned)
+                except AudioCacheFullException:
+                    click.echo("Audio cache is full of upcoming tracks", err=True)
+                    break
+
+                if cached:
+                    fetched += 1
+                else:
+                    failed += 1
+                    click.echo("Failed to fetch {0}".format(file_url), err=True)
+
+        click.echo("{0} tracks cached, {1} failed".format(fetched, failed))
+
+        if interval <= 0:
+            break
+        time.sleep(interval)
+
 
-            yield {
-                "_id": uuid.uuid4(),
-                **entry,
-            }
+@app.cli.command()
+@click.option(
+    "--json-path",
+    required=True,
+    help="JSON array or newline-delimited JSON file of songs.",
+)
+@click.option("--threads", type=int, default=4, help="Bulk requests to send at once.")
+@click.option("--chunk-size", type=int, default=1000, help="Songs per bulk request.")
+@click.option(
+    "--max-chunk-bytes",
+    type=int,
+    default=10 * 1024 * 1024,
+    help="Maximum size of a bulk request in bytes.",
+)
+@click.option(
+    "--keep",
+    type=int,
+    default=2,
+    help="Previous imports to keep around for rollback-songs.",
+)
+@click.option(
+    "--full",
+    is_flag=True,
+    help="Rebuild the index from scratch instead of syncing changes into it.",
+)
+def import_songs(json_path, threads, chunk_size, max_chunk_bytes, keep, full):
+    """Sync the songs index with a list of songs, writing only the songs that
+    were added or changed and deleting the ones that are gone. With --full,
+    if there is no index yet, or if its mapping is out of date, load the
+    songs into a new index and then point the songs alias at it, so searches
+    see the previous import until this one is complete."""
+    from .song_import import (
+        alias_indices,
+        bulk_index,
+        create_versioned_index,
+        gc_indices,
+        mapping_is_current,
+        read_songs,
+        song_actions,
+        swap_alias,
+        sync_index,
+    )
 
     with app.app_context():
-        dest_index = "songs"
-
-        # ignore 400 caused by IndexAlreadyExistsException
-        es.indices.create(index=dest_index, ignore=400)
-
-        es.delete_by_query(
-            dest_index,
-            body={
-                "query": {
-                    "match_all": {},
-                },
-            },
-        )
+        current = alias_indices(es, es.songs_index)
+
+        if len(current) == 1 and not mapping_is_current(es, current[0]):
+            click.echo("{0} has an old mapping; rebuilding".format(current[0]))
+            full = True
+
+        if not full and len(current) == 1:
+            with open(json_path) as f:
+                try:
+                    counts, rate = sync_index(
+                        es,
+                        current[0],
+                        song_actions(read_songs(f)),
+                        threads,
+                        chunk_size,
+                        max_chunk_bytes,
+                    )
+                except ValueError as e:
+                    raise click.ClickException(str(e))
+
+            click.echo(
+                "{added} added, {updated} updated, {unchanged} unchanged, "
+                "{removed} removed, {duplicates} duplicates skipped "
+                "({rate:.0f} docs/sec)".format(rate=rate, **counts)
+            )
+            search_cache.invalidate()
+            return
+
+        dest_index = create_versioned_index(es, es.songs_index)
+
+        try:
+            with open(json_path) as f:
+                indexed, rate = bulk_index(
+                    es,
+                    dest_index,
+                    song_actions(read_songs(f)),
+                    threads,
+                    chunk_size,
+                    max_chunk_bytes,
+                )
+        except BaseException as e:
+            es.indices.delete(index=dest_index, ignore=404)
+            if isinstance(e, ValueError):
+                raise click.ClickException(str(e))
+            raise
+
+        swap_alias(es, es.songs_index, dest_index)
+        search_cache.invalidate()
+        click.echo("Indexed {0} documents ({1:.0f} docs/sec)".format(indexed, rate))
+        click.echo("{0} now points to {1}".format(es.songs_index, dest_index))
+
+        for index in gc_indices(es, es.songs_index, keep):
+            click.echo("Deleted {0}".format(index))
 
-        indexed = 0
 
-        for ok, _, in streaming_bulk(
-            client=es, index=dest_index, actions=generate_actions(json_path)
-        ):
-            indexed += 1
+@app.cli.command()
+def rollback_songs():
+    """Point the songs alias back at the import before the current one."""
+    from .song_import import rollback_alias
+
+    with app.app_context():
+        index = rollback_alias(es, es.songs_index)
+        if index is not None:
+            search_cache.invalidate()
 
-        click.echo("Indexed {0} documents".format(indexed))
+    if index is None:
+        raise click.ClickException("There is no previous import to roll back to")
+    click.echo("{0} now points to {1}".format(es.songs_index, index))
@@ -0,0 +1,188 @@
+import datetime
+import hashlib
+import itsdangerous
+import os
+import re
+import requests.exceptions
+import tempfile
+from .db import db
+from .exceptions import AudioCacheFullException
+from .http_session import http_session
+from .models import Playlist, QueuedTrack
+from .view_utils import get_file_url
+
+
+key_re = re.compile(r"^[0-9a-f]{64}(\.[A-Za-z0-9]{1,8})?$")
+
+
+class AudioCache(object):
+    """Bounded on-disk cache of track files, filled ahead of air time so that
+    the player can fetch them from pload instead of the remote file server.
+    Files are evicted least recently used first, going by modification time,
+    which is updated every time a file is served, except for pinned files,
+    which belong to tracks that are about to play. Files are only served
+    with a token, signed with SECRET_KEY, that expires after
+    AUDIO_CACHE_TOKEN_TTL seconds."""
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.max_size = 0
+        self.serializer = None
+        self.token_ttl = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config["AUDIO_CACHE_DIR"]
+        self.max_size = app.config["AUDIO_CACHE_MAX_SIZE"]
+        self.serializer = itsdangerous.URLSafeTimedSerializer(
+            app.config["SECRET_KEY"], salt="pload.audio_cache"
+        )
+        self.token_ttl = app.config["AUDIO_CACHE_TOKEN_TTL"]
+
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def key_for(self, file_url):
+        key = hashlib.sha256(file_url.encode("utf-8")).hexdigest()
+
+        # keep the extension so the player can tell what kind of file it is
+        ext = file_url.rsplit("/", 1)[-1].rsplit(".", 1)
+        if len(ext) == 2 and re.match(r"^[A-Za-z0-9]{1,8}$", ext[1]):
+            key += "." + ext[1].lower()
+
+        return key
+
+    def path_for(self, key):
+        if key_re.match(key) is None:
+            raise ValueError("Invalid cache key")
+        return os.path.join(self.directory, key)
+
+    def token_for(self, key):
+        """A token that lets whoever has it download a cached file for the
+        next AUDIO_CACHE_TOKEN_TTL seconds."""
+        return self.serializer.dumps(key)
+
+    def check_token(self, key, token):
+        try:
+            signed_key = self.serializer.loads(token, max_age=self.token_ttl)
+        except itsdangerous.BadData:
+            return False
+        return signed_key == key
+
+    def lookup(self, file_url):
+        """Return the cache key for a file if it has been cached, or None."""
+        if not self.enabled:
+            return None
+
+        key = self.key_for(file_url)
+        if os.path.exists(self.path_for(key)):
+            return key
+        return None
+
+    def touch(self, key):
+        try:
+            os.utime(self.path_for(key))
+        except OSError:
+            pass
+
+    def fetch(self, file_url, pinned=()):
+        """Download a file into the cache unless it is there already. Returns
+        True if the file is cached afterwards. Files whose keys are in pinned
+        are never evicted to make room; if they alone fill the cache, the new
+        file is dropped again and AudioCacheFullException is raised."""
+        key = self.key_for(file_url)
+        path = self.path_for(key)
+        if os.path.exists(path):
+            self.touch(key)
+            return True
+
+        try:
+            r = http_session.get(file_url, stream=True)
+            r.raise_for_status()
+        except requests.exceptions.RequestException:
+            return False
+
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(prefix=".fetch-", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in r.iter_content(chunk_size=65536):
+                    size += len(chunk)
+                    if size > self.max_size:
+                        # this would push everything else out of the cache
+                        raise ValueError("File too large to cache")
+                    f.write(chunk)
+
+            # only ever expose complete files under their real name
+            os.replace(tmp_path, path)
+        except (OSError, ValueError, requests.exceptions.RequestException):
+            os.unlink(tmp_path)
+            return False
+        finally:
+            r.close()
+
+        if not self.evict(set(pinned) | {key}):
+            # the other pinned files play first, so this one has to give way
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            raise AudioCacheFullException("Audio cache is full of pinned files")
+        return True
+
+    def evict(self, pinned=()):
+        """Remove the least recently used files, other than those whose keys
+        are in pinned, until the cache fits within AUDIO_CACHE_MAX_SIZE.
+        Returns False if it still does not fit."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and key_re.match(entry.name) is not None:
+                    stat = entry.stat()
+                    total += stat.st_size
+                    if entry.name not in pinned:
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        return total <= self.max_size
+
+
+def upcoming_file_urls(minutes):
+    """File URLs for tracks that have not been handed out yet, in approved
+    playlists that are on air now or start within the given number of
+    minutes, in the order they will play."""
+    now = datetime.datetime.utcnow()
+    rows = (
+        db.session.query(QueuedTrack.url)
+        .join(Playlist, QueuedTrack.playlist_id == Playlist.id)
+        .filter(
+            Playlist.approved != None,
+            Playlist.timeslot_start <= now + datetime.timedelta(minutes=minutes),
+            Playlist.timeslot_end > now,
+            QueuedTrack.position >= Playlist.cursor,
+        )
+        .order_by(Playlist.timeslot_start, QueuedTrack.position)
+    )
+
+    for (url,) in rows:
+        yield get_file_url(url)
+
+
+audio_cache = AudioCache()
@@ -0,0 +1,67 @@
+import collections
+import threading
+import time
+
+
+class TTLCache(object):
+    """Thread-safe in-memory cache holding at most max_size entries, dropping
+    the least recently used first. Each entry has its own time to live;
+    expired entries are kept (until pushed out) so that callers can revalidate
+    them instead of starting from scratch."""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """Return (value, fresh) for a key, or (None, False) if it is not
+        cached at all."""
+        with self.lock:
+            try:
+                expires, value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return None, False
+
+            self.entries.move_to_end(key)
+            fresh = time.monotonic() < expires
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return value, fresh
+
+    def get(self, key, default=None):
+        value, fresh = self.lookup(key)
+        if fresh:
+            return value
+        return default
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -7,12 +7,46 @@ SQLALCHEMY_ENGINE_OPTIONS = {"pool_pre_ping": True}
 ELASTICSEARCH_HOSTS = [
     "http://elasticsearch:9200/",
 ]
+ELASTICSEARCH_SONGS_INDEX = "songs"
+SEARCH_SUGGEST_SIZE = 10
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 500
+SEARCH_CACHE_SIZE = 1000
+SEARCH_CACHE_TTL = 600
+SEARCH_CACHE_PATH = None
+SEARCH_CACHE_SHARED_SIZE = 10000
+SEARCH_CACHE_GENERATION_TTL = 10
+
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 10
+HTTP_CONNECT_TIMEOUT = 3.05
+HTTP_READ_TIMEOUT = 30
+HTTP_RETRIES = 2
+HTTP_RETRY_BACKOFF = 0.5
 
 TIME_SLOT_TZ = "America/New_York"
 
+SCHEDULE_INDEX_REFRESH = 30
+NEXT_TRACK_MAX_WAIT = 60
+NEXT_TRACK_RECHECK_INTERVAL = 5
+NEXT_TRACKS_MAX = 10
+TRACK_LEASE_TIME = 1800
+
 TRACKMAN_URL = "https://trackman-fm.apps.wuvt.vt.edu/"
 
+AUDIO_CACHE_DIR = None
+AUDIO_CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+AUDIO_CACHE_PREFETCH_MINUTES = 30
+AUDIO_CACHE_TOKEN_TTL = 3600
+
 TRACK_VALIDATE_CHECK_EXISTS = True
+TRACK_VALIDATE_WORKERS = 16
+TRACK_VALIDATE_PER_HOST = 4
+TRACK_VALIDATE_CACHE_SIZE = 10000
+TRACK_VALIDATE_CACHE_TTL = 3600
+TRACK_VALIDATE_NEGATIVE_CACHE_TTL = 60
+TRACK_METADATA_CACHE_SIZE = 100000
+TRACK_METADATA_CACHE_TTL = 7 * 24 * 60 * 60
 TRACK_URL_REWRITES = [
     (r"^https:\/\/files\.apps\.wuvt\.vt\.edu", "http://titanic.wuvt.vt.edu"),
     (
@@ -30,3 +64,4 @@ TRACK_URL_DISPLAY_REWRITES = [
         "https://linx.apps.wuvt.vt.edu/",
     ),
 ]
+TRACK_URL_REWRITE_CACHE_SIZE = 4096
@@ -8,6 +8,7 @@ class Elasticsearch(ElasticsearchBase):
 
     def init_app(self, app):
         super().__init__(hosts=app.config["ELASTICSEARCH_HOSTS"],)
+        self.songs_index = app.config["ELASTICSEARCH_SONGS_INDEX"]
 
 
 es = Elasticsearch()
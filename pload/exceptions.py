@@ -4,3 +4,7 @@ class PlaylistExistsException(Exception):
 
 class PlaylistValidationException(Exception):
     pass
+
+
+class AudioCacheFullException(Exception):
+    pass
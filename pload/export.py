@@ -0,0 +1,122 @@
+import hashlib
+import io
+import zipfile
+from .db import db
+from .metadata import metadata_cache
+from .models import QueuedTrack
+from .view_utils import get_file_url
+
+
+# number of rows fetched from the database cursor at a time
+export_chunk_size = 500
+
+
+def playlist_etag(playlist_id, extinf=False):
+    """An ETag for the exported playlist: a hash of the IDs and URLs of its
+    tracks in play order, so that any change to what or in which order the
+    export would list, including a pure reorder, changes it. With extinf, it
+    also covers when each track's metadata was cached, if it is, since that
+    decides the #EXTINF lines. Only those columns are read, in chunks through
+    a server-side cursor."""
+    result = db.session.execute(
+        db.select(QueuedTrack.id, QueuedTrack.url)
+        .where(QueuedTrack.playlist_id == playlist_id)
+        .order_by(QueuedTrack.position)
+        .execution_options(stream_results=True)
+    )
+
+    digest = hashlib.sha1()
+    header = "{0}:{1}\n".format(playlist_id, "extinf" if extinf else "plain")
+    digest.update(header.encode("utf-8"))
+    for rows in result.partitions(export_chunk_size):
+        if extinf:
+            fetched = metadata_cache.fetched([get_file_url(url) for _, url in rows])
+        for track_id, url in rows:
+            line = "{0}:{1}\n".format(track_id, url)
+            if extinf:
+                line = "{0}:{1}".format(fetched.get(get_file_url(url)), line)
+            digest.update(line.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def extinf_line(metadata):
+    length = metadata.get("length", -1)
+    title = " - ".join(
+        metadata[field] for field in ("artist", "title") if metadata.get(field)
+    )
+    return "#EXTINF:{0:d},{1}\n".format(length, title.replace("\n", " "))
+
+
+def generate_m3u8(playlist_id, extinf=False):
+    """Generate the M3U8 playlist in chunks, reading only the track URLs from
+    the database through a server-side cursor. With extinf, tracks that are
+    in the metadata cache get #EXTINF lines; nothing is fetched to fill in
+    the rest."""
+    result = db.session.execute(
+        db.select(QueuedTrack.url)
+        .where(QueuedTrack.playlist_id == playlist_id)
+        .order_by(QueuedTrack.position)
+        .execution_options(stream_results=True)
+    )
+
+    if extinf:
+        yield "#EXTM3U\n"
+
+    for rows in result.partitions(export_chunk_size):
+        urls = [url for url, in rows]
+
+        if extinf:
+            file_urls = [get_file_url(url) for url in urls]
+            cached = metadata_cache.lookup(set(file_urls))
+
+            lines = []
+            for url, file_url in zip(urls, file_urls):
+                if file_url in cached:
+                    metadata = {
+                        field: getattr(cached[file_url], field)
+                        for field in ("artist", "title", "length")
+                        if getattr(cached[file_url], field) is not None
+                    }
+                    lines.append(extinf_line(metadata))
+                lines.append("{0}\n".format(url))
+            yield "".join(lines)
+        else:
+            yield "".join("{0}\n".format(url) for url in urls)
+
+
+class ZipStream(io.RawIOBase):
+    """Write-only, unseekable file that hands back whatever was written to it
+    since the last call to read_written, so a zip file can be streamed."""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def read_written(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def generate_zip(files):
+    """Generate a zip archive in chunks from an iterable of (filename, chunk
+    generator) tuples, without holding more than one chunk in memory."""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for filename, chunks in files:
+            with archive.open(filename, "w") as f:
+                for chunk in chunks:
+                    f.write(chunk.encode("utf-8"))
+                    data = stream.read_written()
+                    if len(data) > 0:
+                        yield data
+
+    # trailers of the last file and the central directory
+    yield stream.read_written()
@@ -0,0 +1,70 @@
+import requests
+import threading
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class HTTPSession(object):
+    """Outbound HTTP requests, made through one connection pool so that
+    connections to the same few hosts (the file servers and Trackman) are
+    kept alive and reused. requests.Session itself is not thread-safe, so
+    each thread gets its own, all mounting the same adapter and its pool.
+    Every request gets the configured timeouts unless it passes its own, and
+    idempotent requests are retried with backoff on connection errors and
+    gateway errors."""
+
+    def __init__(self, app=None):
+        self.adapter = None
+        self.timeout = None
+        self.local = threading.local()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        retries = Retry(
+            total=app.config["HTTP_RETRIES"],
+            backoff_factor=app.config["HTTP_RETRY_BACKOFF"],
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["HEAD", "GET", "OPTIONS"]),
+            raise_on_status=False,
+        )
+        # urllib3's pools are thread-safe, so one adapter serves every thread
+        self.adapter = HTTPAdapter(
+            pool_connections=app.config["HTTP_POOL_CONNECTIONS"],
+            pool_maxsize=app.config["HTTP_POOL_MAXSIZE"],
+            max_retries=retries,
+        )
+        self.local = threading.local()
+
+        self.timeout = (
+            app.config["HTTP_CONNECT_TIMEOUT"],
+            app.config["HTTP_READ_TIMEOUT"],
+        )
+
+    @property
+    def session(self):
+        """This thread's session."""
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            if self.adapter is not None:
+                session.mount("http://", self.adapter)
+                session.mount("https://", self.adapter)
+            self.local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        # like requests.Session.head, don't follow redirects unless asked to
+        kwargs.setdefault("allow_redirects", False)
+        return self.request("HEAD", url, **kwargs)
+
+
+http_session = HTTPSession()
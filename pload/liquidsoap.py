@@ -0,0 +1,117 @@
+import re
+
+
+# protocols that only change how Liquidsoap plays the URI that follows them
+passthrough_protocols = ("ffmpeg", "replay_gain")
+
+# every pattern here matches in linear time, even on long annotations; quoted
+# values are matched as runs of plain characters between escapes, rather than
+# one character at a time, which keeps the regex engine from backtracking
+annotation_re = re.compile(
+    r'(?P<key>[^=,:"]+)='
+    r'(?:"(?P<quoted>[^"\\]*(?:\\.[^"\\]*)*)"|(?P<value>[^",:]*))',
+    re.DOTALL,
+)
+escape_re = re.compile(r"\\(.)", re.DOTALL)
+unquoted_value_re = re.compile(r"^[0-9]+$")
+
+
+class LiquidsoapURI(object):
+    """A Liquidsoap request URI, such as
+    annotate:title="Foo",artist="Bar":replay_gain:http://example.com/foo.mp3,
+    split into the chain of protocols wrapping the actual URL. Each protocol
+    is a (name, annotations) tuple; annotations is a dict for annotate and
+    None for everything else."""
+
+    def __init__(self, url, protocols=None):
+        self.url = url
+        self.protocols = protocols if protocols is not None else []
+
+    @classmethod
+    def parse(cls, uri):
+        """Parse a URI in a single pass. Raises ValueError if it is
+        malformed."""
+        protocols = []
+        pos = 0
+
+        while True:
+            if uri.startswith("annotate:", pos):
+                annotations, pos = parse_annotations(uri, pos + len("annotate:"))
+                protocols.append(("annotate", annotations))
+                continue
+
+            for name in passthrough_protocols:
+                if uri.startswith(name + ":", pos):
+                    protocols.append((name, None))
+                    pos += len(name) + 1
+                    break
+            else:
+                break
+
+        return cls(uri[pos:], protocols)
+
+    @property
+    def annotations(self):
+        """All annotations, with outer ones taking precedence."""
+        result = {}
+        for name, annotations in reversed(self.protocols):
+            if annotations is not None:
+                result.update(annotations)
+        return result
+
+    def annotate(self, key, value):
+        """Set an annotation on the outermost annotate protocol, adding one
+        if there is none."""
+        if len(self.protocols) == 0 or self.protocols[0][0] != "annotate":
+            self.protocols.insert(0, ("annotate", {}))
+        self.protocols[0][1][key] = value
+
+    def __str__(self):
+        parts = []
+        for name, annotations in self.protocols:
+            if annotations is not None:
+                parts.append(
+                    "{0}:{1}:".format(
+                        name,
+                        ",".join(
+                            "{0}={1}".format(key, quote_value(value))
+                            for key, value in annotations.items()
+                        ),
+                    )
+                )
+            else:
+                parts.append(name + ":")
+        parts.append(self.url)
+        return "".join(parts)
+
+
+def quote_value(value):
+    if unquoted_value_re.match(value) is not None:
+        return value
+    return '"{0}"'.format(value.replace("\\", "\\\\").replace('"', '\\"'))
+
+
+def parse_annotations(uri, pos):
+    """Parse the key=value list of an annotate protocol starting at pos, up to
+    and including the colon that ends it. Returns the annotations and the
+    position just past that colon."""
+    annotations = {}
+
+    while True:
+        m = annotation_re.match(uri, pos)
+        if m is None:
+            raise ValueError("Malformed annotation")
+
+        if m.group("quoted") is not None:
+            value = escape_re.sub(r"\1", m.group("quoted"))
+        else:
+            value = m.group("value")
+        annotations[m.group("key")] = value
+        pos = m.end()
+
+        if uri.startswith(",", pos):
+            pos += 1
+        elif uri.startswith(":", pos):
+            return annotations, pos + 1
+        else:
+            raise ValueError("Annotations must be followed by a URI")
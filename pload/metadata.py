@@ -0,0 +1,344 @@
+import datetime
+import elasticsearch
+import requests.exceptions
+import sqlalchemy as sa
+import threading
+from .db import db
+from .es import es
+from .http_session import http_session
+from .models import TrackMetadata
+from .song_import import song_id
+from .tags import open_remote_file, read_file_tags
+from .view_utils import get_file_url, map_by_host
+
+
+track_metadata = TrackMetadata.__table__
+
+text_fields = ("artist", "title", "album", "label")
+number_fields = ("bitrate", "sample", "length")
+metadata_fields = text_fields + number_fields
+
+
+class MetadataCache(object):
+    """Track metadata cache, stored in the database so that it is shared by
+    every worker. Entries older than TRACK_METADATA_CACHE_TTL are revalidated
+    with a conditional request before they are used again, and every so
+    often the least recently used entries beyond TRACK_METADATA_CACHE_SIZE
+    are evicted."""
+
+    # how stale last_used may get before a hit updates it; this saves a write
+    # on almost every hit, and is plenty for deciding what to evict
+    last_used_resolution = datetime.timedelta(hours=1)
+
+    # inserts between each pass that counts the entries and evicts the surplus
+    evict_interval = 100
+
+    def __init__(self, app=None):
+        self.max_size = 0
+        self.ttl = datetime.timedelta(0)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.inserts = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_size = app.config["TRACK_METADATA_CACHE_SIZE"]
+        self.ttl = datetime.timedelta(seconds=app.config["TRACK_METADATA_CACHE_TTL"])
+
+    def count(self, name, n=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def lookup(self, file_urls):
+        """Return the cached rows for a set of file URLs, keyed by URL."""
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                sa.select(track_metadata).where(track_metadata.c.url.in_(file_urls))
+            ).all()
+        return {row.url: row for row in rows}
+
+    def fetched(self, file_urls):
+        """Return when each of a set of file URLs was last cached, keyed by
+        URL, leaving out those that are not."""
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                sa.select(track_metadata.c.url, track_metadata.c.fetched).where(
+                    track_metadata.c.url.in_(set(file_urls))
+                )
+            ).all()
+        return {row.url: row.fetched for row in rows}
+
+    def is_fresh(self, row, now):
+        return row.fetched + self.ttl > now
+
+    def revalidate(self, row, now):
+        """Check with the file server whether a stale entry still holds.
+        Returns True, and marks the entry fresh again, if it does."""
+        if row.etag is None and row.last_modified is None:
+            return False
+
+        headers = {}
+        if row.etag is not None:
+            headers["If-None-Match"] = row.etag
+        if row.last_modified is not None:
+            headers["If-Modified-Since"] = row.last_modified
+
+        try:
+            r = http_session.head(row.url, headers=headers, allow_redirects=True)
+        except requests.exceptions.RequestException:
+            return False
+
+        if r.status_code == 304 or (
+            r.status_code == 200
+            and row.etag is not None
+            and r.headers.get("ETag") == row.etag
+        ):
+            with db.engine.begin() as conn:
+                conn.execute(
+                    sa.update(track_metadata)
+                    .where(track_metadata.c.url == row.url)
+                    .values(fetched=now, last_used=now)
+                )
+            self.count("revalidated")
+            return True
+
+        return False
+
+    def touch(self, file_urls, now):
+        with db.engine.begin() as conn:
+            conn.execute(
+                sa.update(track_metadata)
+                .where(
+                    track_metadata.c.url.in_(file_urls),
+                    track_metadata.c.last_used <= now - self.last_used_resolution,
+                )
+                .values(last_used=now)
+            )
+
+    def store(self, file_url, metadata, etag=None, last_modified=None):
+        now = datetime.datetime.utcnow()
+        values = dict.fromkeys(metadata_fields)
+        values.update(normalize_metadata(metadata))
+        values.update(
+            {
+                "etag": etag,
+                "last_modified": last_modified,
+                "fetched": now,
+                "last_used": now,
+            }
+        )
+
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                sa.update(track_metadata)
+                .where(track_metadata.c.url == file_url)
+                .values(**values)
+            )
+
+        if result.rowcount == 0:
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(
+                        sa.insert(track_metadata).values(url=file_url, **values)
+                    )
+            except sa.exc.IntegrityError:
+                # another worker cached it at the same time
+                return
+
+            self.count("inserts")
+            if self.inserts % self.evict_interval == 0:
+                with db.engine.begin() as conn:
+                    self.evict(conn)
+
+    def evict(self, conn):
+        total = conn.execute(sa.select(sa.func.count(track_metadata.c.url))).scalar()
+        if total <= self.max_size:
+            return
+
+        oldest = (
+            sa.select(track_metadata.c.url)
+            .order_by(track_metadata.c.last_used)
+            .limit(total - self.max_size)
+            .scalar_subquery()
+        )
+        conn.execute(sa.delete(track_metadata).where(track_metadata.c.url.in_(oldest)))
+
+    def stats(self):
+        with db.engine.connect() as conn:
+            size = conn.execute(sa.select(sa.func.count(track_metadata.c.url))).scalar()
+
+        with self.lock:
+            return {
+                "size": size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+            }
+
+
+metadata_cache = MetadataCache()
+
+
+def normalize_metadata(metadata):
+    """Cut metadata from any source down to metadata_fields, with numbers as
+    integers, leaving out fields that are not set, which is the form cached
+    entries come back in."""
+    result = {
+        field: metadata[field]
+        for field in text_fields
+        if metadata.get(field) is not None
+    }
+    for field in number_fields:
+        # the songs index may hold these as strings, or not at all
+        try:
+            result[field] = int(metadata[field])
+        except (KeyError, TypeError, ValueError):
+            pass
+    return result
+
+
+def row_to_metadata(row):
+    return {
+        field: getattr(row, field)
+        for field in metadata_fields
+        if getattr(row, field) is not None
+    }
+
+
+def search_tracks_metadata(urls):
+    """Look up metadata for processed track URLs in the songs index by the
+    IDs their documents are stored under, all in one request. Returns a dict
+    of metadata keyed by URL, leaving out tracks that are not in the index."""
+    found = {}
+    urls = list(urls)
+
+    try:
+        results = es.mget(
+            index=es.songs_index,
+            body={"ids": [song_id(url) for url in urls]},
+            _source_includes=list(metadata_fields) + ["url"],
+        )
+        for url, doc in zip(urls, results["docs"]):
+            if doc.get("found") and doc["_source"].get("url") == url:
+                found[url] = normalize_metadata(doc["_source"])
+    except (
+        elasticsearch.ImproperlyConfigured,
+        elasticsearch.ElasticsearchException,
+        elasticsearch.exceptions.RequestError,
+    ):
+        pass
+
+    return found
+
+
+def read_track_metadata(file_url, row, now):
+    """Get metadata for a track that is neither freshly cached nor in the
+    songs index, by revalidating the cached entry if there is one, or else by
+    reading the tags from the file itself."""
+    if row is not None and metadata_cache.revalidate(row, now):
+        metadata_cache.count("hits")
+        return row_to_metadata(row)
+
+    metadata_cache.count("misses")
+
+    try:
+        f = open_remote_file(file_url)
+    except requests.exceptions.RequestException:
+        return {}
+
+    with f:
+        metadata = read_file_tags(f)
+
+    metadata = normalize_metadata(metadata)
+
+    # failures may well be temporary, so only cache what we actually found
+    if len(metadata) > 0:
+        metadata_cache.store(file_url, metadata, f.etag, f.last_modified)
+    return metadata
+
+
+def lookup_cached_metadata(file_urls, now):
+    """Look up metadata for a list of file URLs in the metadata cache. Returns
+    the cached rows keyed by URL, a list of metadata in the same order as the
+    URLs, with None where there is no fresh entry, and the indexes of those."""
+    results = [None] * len(file_urls)
+
+    rows = metadata_cache.lookup(set(file_urls))
+    hits = set()
+    pending = []
+    for index, file_url in enumerate(file_urls):
+        row = rows.get(file_url)
+        if row is not None and metadata_cache.is_fresh(row, now):
+            results[index] = row_to_metadata(row)
+            hits.add(file_url)
+        else:
+            pending.append(index)
+
+    if len(hits) > 0:
+        metadata_cache.count("hits", len(file_urls) - len(pending))
+        metadata_cache.touch(hits, now)
+
+    return rows, results, pending
+
+
+def get_cached_tracks_metadata(urls):
+    """Look up metadata for a list of processed track URLs in the metadata
+    cache alone, without waiting on the songs index or the file servers.
+    Returns a list in the same order as the URLs, with None for tracks that
+    have no fresh entry."""
+    now = datetime.datetime.utcnow()
+    file_urls = [get_file_url(url) for url in urls]
+    _, results, _ = lookup_cached_metadata(file_urls, now)
+    return results
+
+
+def get_tracks_metadata(urls):
+    """Look up metadata for a list of processed track URLs, first in the
+    metadata cache, then in the songs index and then by reading the tags from
+    the files themselves, several at a time. Returns a list of metadata in the
+    same order as the URLs."""
+    now = datetime.datetime.utcnow()
+    file_urls = [get_file_url(url) for url in urls]
+    rows, results, pending = lookup_cached_metadata(file_urls, now)
+
+    if len(pending) > 0:
+        found = search_tracks_metadata(set(urls[index] for index in pending))
+    else:
+        found = {}
+
+    remaining = []
+    for index in pending:
+        metadata = found.get(urls[index])
+        if metadata is not None:
+            metadata_cache.count("misses")
+            metadata_cache.store(file_urls[index], metadata)
+            results[index] = metadata
+        else:
+            remaining.append(index)
+
+    # the same file may well appear more than once in a playlist
+    to_read = list(dict.fromkeys(file_urls[index] for index in remaining))
+    if len(to_read) == 1:
+        # not worth starting any threads for
+        read = [read_track_metadata(to_read[0], rows.get(to_read[0]), now)]
+    else:
+        read = map_by_host(
+            lambda file_url: read_track_metadata(file_url, rows.get(file_url), now),
+            to_read,
+        )
+
+    read = dict(zip(to_read, read))
+    for index in remaining:
+        results[index] = read[file_urls[index]]
+
+    return results
+
+
+def get_track_metadata(url):
+    """Look up metadata for a single processed track URL."""
+    return get_tracks_metadata([url])[0]
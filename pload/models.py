@@ -3,25 +3,51 @@ from .db import db
 
 
 class QueuedTrack(db.Model):
+    __table_args__ = (
+        db.Index("ix_queued_track_playlist_id_position", "playlist_id", "position"),
+        db.Index(
+            "ix_queued_track_playlist_id_played_lease_expires",
+            "playlist_id",
+            "played",
+            "lease_expires",
+        ),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     url = db.Column(db.Unicode(2048), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
     played = db.Column(db.Boolean, default=False, nullable=False)
+    lease_token = db.Column(db.Unicode(32), nullable=True)
+    lease_expires = db.Column(db.DateTime, nullable=True)
     playlist_id = db.Column(db.Integer, db.ForeignKey("playlist.id"))
     playlist = db.relationship("Playlist", backref=db.backref("tracks", lazy="dynamic"))
 
-    def __init__(self, url, playlist_id):
+    def __init__(self, url, playlist_id, position):
         self.url = url
         self.playlist_id = playlist_id
+        self.position = position
 
     def serialize(self):
         return {
             "id": self.id,
             "url": self.url,
+            "position": self.position,
             "played": self.played,
         }
 
 
 class Playlist(db.Model):
+    __table_args__ = (
+        db.Index(
+            "ix_playlist_queue_approved_timeslot",
+            "queue",
+            "approved",
+            "timeslot_start",
+            "timeslot_end",
+        ),
+        db.Index("ix_playlist_timeslot_end", "timeslot_end"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     timeslot_start = db.Column(db.DateTime, nullable=False)
     timeslot_end = db.Column(db.DateTime, nullable=False)
@@ -30,12 +56,20 @@ class Playlist(db.Model):
     added = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=True)
     approved = db.Column(db.DateTime, nullable=True)
     uploader = db.Column(db.Unicode(255), nullable=True)
+    # number of tracks, from the start of the playlist, that have been handed
+    # out to a player; the next track to play is the one at this position
+    cursor = db.Column(db.Integer, default=0, nullable=False)
 
     def __init__(self, timeslot_start, timeslot_end, dj_id=None, queue=None):
         self.timeslot_start = timeslot_start
         self.timeslot_end = timeslot_end
         self.dj_id = dj_id
         self.queue = queue
+        self.cursor = 0
+
+    @property
+    def started(self):
+        return self.cursor > 0
 
     def serialize(self):
         return {
@@ -47,4 +81,35 @@ class Playlist(db.Model):
             "added": self.added,
             "approved": self.approved,
             "uploader": self.uploader,
+            "cursor": self.cursor,
         }
+
+
+class TrackMetadata(db.Model):
+    """Cached metadata for a track file, keyed by its file URL, so that tags
+    are only read once no matter which worker is asked."""
+
+    __table_args__ = (db.Index("ix_track_metadata_last_used", "last_used"),)
+
+    url = db.Column(db.Unicode(2048), primary_key=True)
+    artist = db.Column(db.UnicodeText, nullable=True)
+    title = db.Column(db.UnicodeText, nullable=True)
+    album = db.Column(db.UnicodeText, nullable=True)
+    label = db.Column(db.UnicodeText, nullable=True)
+    bitrate = db.Column(db.Integer, nullable=True)
+    sample = db.Column(db.Integer, nullable=True)
+    length = db.Column(db.Integer, nullable=True)
+    # validators from the file server, used to revalidate stale entries
+    etag = db.Column(db.Unicode(255), nullable=True)
+    last_modified = db.Column(db.Unicode(64), nullable=True)
+    fetched = db.Column(db.DateTime, nullable=False)
+    last_used = db.Column(db.DateTime, nullable=False)
+
+
+class SongCatalog(db.Model):
+    """A single row counting imports of the song library, so that anything
+    cached from a search can tell when the catalog has changed under it."""
+
+    id = db.Column(db.Integer, primary_key=True)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,87 @@
+import itertools
+import re
+
+
+pls_entry_re = re.compile(r"^(File|Title|Length)(\d+)=(.*)$", re.IGNORECASE)
+extinf_re = re.compile(r"^#EXTINF:\s*(-?\d+)[^,]*,(.*)$")
+
+
+class PlaylistEntry(object):
+    def __init__(self, line, url, title=None, length=None):
+        self.line = line
+        self.url = url
+        self.title = title
+        self.length = length
+
+
+def parse_m3u(lines):
+    """Yield the entries of an M3U or M3U8 playlist as the lines come in,
+    taking titles and lengths from #EXTINF lines."""
+    title = None
+    length = None
+
+    for number, line in lines:
+        if line.startswith("#"):
+            m = extinf_re.match(line)
+            if m is not None:
+                # a length of -1 means unknown
+                length = int(m.group(1)) if int(m.group(1)) >= 0 else None
+                title = m.group(2).strip() or None
+            continue
+
+        yield PlaylistEntry(number, line, title, length)
+        title = None
+        length = None
+
+
+def parse_pls(lines):
+    """Yield the entries of a PLS playlist in the order they are numbered.
+    Titles and lengths may come after the file they belong to, so the whole
+    playlist is read first."""
+    entries = {}
+
+    for number, line in lines:
+        m = pls_entry_re.match(line)
+        if m is None:
+            continue
+
+        key, index, value = m.group(1).lower(), int(m.group(2)), m.group(3).strip()
+        entry = entries.setdefault(index, PlaylistEntry(number, None))
+        if key == "file":
+            entry.line = number
+            entry.url = value
+        elif key == "title":
+            entry.title = value or None
+        elif key == "length":
+            try:
+                entry.length = int(value)
+            except ValueError:
+                pass
+            else:
+                if entry.length < 0:
+                    entry.length = None
+
+    for index in sorted(entries.keys()):
+        if entries[index].url is not None:
+            yield entries[index]
+
+
+def parse_playlist(f, filename=""):
+    """Parse a playlist file, given as an iterable of text lines, as PLS if it
+    looks like one and as M3U otherwise. Yields a PlaylistEntry for each
+    track, with the line number its URL was found on."""
+    lines = (
+        (number, line.strip().lstrip("\ufeff"))
+        for number, line in enumerate(f, start=1)
+    )
+    lines = ((number, line) for number, line in lines if len(line) > 0)
+
+    first = next(lines, None)
+    if first is None:
+        return
+
+    lines = itertools.chain([first], lines)
+    if filename.lower().endswith(".pls") or first[1].lower() == "[playlist]":
+        yield from parse_pls(lines)
+    else:
+        yield from parse_m3u(lines)
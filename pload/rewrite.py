@@ -0,0 +1,73 @@
+import functools
+import re
+
+
+# characters that end the literal part of a pattern
+regex_special = set(".^$*+?{}[]\\|()")
+# quantifiers that make the preceding character optional
+regex_optional = set("*?{")
+
+
+def literal_prefix(pattern):
+    """Return the literal text that every match of an anchored pattern must
+    start with, or None if matches may start anywhere. The result may be
+    shorter than the true prefix but never longer."""
+    if not pattern.startswith("^") or "|" in pattern:
+        return None
+
+    prefix = []
+    i = 1
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\":
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                # character class or backreference
+                break
+            char = pattern[i + 1]
+            i += 2
+        elif char in regex_special:
+            break
+        else:
+            i += 1
+
+        if i < len(pattern) and pattern[i] in regex_optional:
+            break
+        prefix.append(char)
+
+    return "".join(prefix)
+
+
+class RewriteEngine(object):
+    """Applies a list of (regular expression, replacement) rules to URLs in
+    order, as re.sub would one after the other. Patterns are compiled once,
+    rules whose anchored literal prefix does not match the URL are skipped
+    without running the regular expression, and recent results are kept in
+    an LRU cache since the same URLs are rewritten over and over."""
+
+    def __init__(self, config_key, app=None):
+        self.config_key = config_key
+        self.rules = []
+        self.rewrite = self._rewrite
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rules = [
+            (literal_prefix(pattern), re.compile(pattern), replacement)
+            for pattern, replacement in app.config[self.config_key]
+        ]
+        self.rewrite = functools.lru_cache(
+            maxsize=app.config["TRACK_URL_REWRITE_CACHE_SIZE"]
+        )(self._rewrite)
+
+    def _rewrite(self, url):
+        for prefix, pattern, replacement in self.rules:
+            if prefix is not None and not url.startswith(prefix):
+                continue
+            url = pattern.sub(replacement, url)
+        return url
+
+
+file_url_rewriter = RewriteEngine("TRACK_URL_REWRITES")
+display_url_rewriter = RewriteEngine("TRACK_URL_DISPLAY_REWRITES")
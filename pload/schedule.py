@@ -0,0 +1,177 @@
+import bisect
+import collections
+import datetime
+import threading
+import time
+from dateutil.tz import UTC
+from .models import Playlist
+
+
+ScheduledPlaylist = collections.namedtuple(
+    "ScheduledPlaylist", ["id", "timeslot_start", "timeslot_end", "queue", "dj_id"]
+)
+
+
+def to_naive_utc(value):
+    """Timeslots are stored as naive UTC datetimes; make sure anything we
+    compare against them is as well."""
+    if value.tzinfo is not None:
+        value = value.astimezone(UTC).replace(tzinfo=None)
+    return value
+
+
+def schedule_query(now):
+    return Playlist.query.with_entities(
+        Playlist.id,
+        Playlist.timeslot_start,
+        Playlist.timeslot_end,
+        Playlist.queue,
+        Playlist.dj_id,
+    ).filter(
+        Playlist.timeslot_end > now,
+        Playlist.approved != None,
+    )
+
+
+class ScheduleIndex(object):
+    """Per-worker index of approved playlists that have not ended yet, kept as
+    a list sorted by start time for each queue so that finding the playlist
+    that is on air is a bisect rather than a database query.
+
+    Changes made by this worker are applied incrementally; changes made by
+    other workers are picked up when the index is reloaded, which happens at
+    most SCHEDULE_INDEX_REFRESH seconds after the last load."""
+
+    def __init__(self, app=None):
+        self.refresh_interval = 30
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.clear()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.refresh_interval = app.config["SCHEDULE_INDEX_REFRESH"]
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.starts = {}
+            self.entries = {}
+            self.loaded_at = None
+
+    def is_stale(self):
+        return (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at > self.refresh_interval
+        )
+
+    def reload(self):
+        rows = schedule_query(datetime.datetime.utcnow()).all()
+
+        with self.lock:
+            self.starts = {}
+            self.entries = {}
+            for row in rows:
+                self._insert(ScheduledPlaylist(*row))
+            self.loaded_at = time.monotonic()
+
+    def _insert(self, entry):
+        starts = self.starts.setdefault(entry.queue, [])
+        entries = self.entries.setdefault(entry.queue, [])
+        i = bisect.bisect_right(starts, entry.timeslot_start)
+        starts.insert(i, entry.timeslot_start)
+        entries.insert(i, entry)
+
+    def _remove(self, playlist_id):
+        for queue, entries in self.entries.items():
+            for i, entry in enumerate(entries):
+                if entry.id == playlist_id:
+                    del entries[i]
+                    del self.starts[queue][i]
+                    return
+
+    def update(self, playlist):
+        """Add or replace a playlist after it has been changed. Playlists that
+        are not approved or have already ended are dropped from the index."""
+        if self.loaded_at is None:
+            # nothing loaded yet, so the next lookup will pick this up
+            return
+
+        entry = ScheduledPlaylist(
+            playlist.id,
+            to_naive_utc(playlist.timeslot_start),
+            to_naive_utc(playlist.timeslot_end),
+            playlist.queue,
+            playlist.dj_id,
+        )
+
+        with self.lock:
+            self._remove(entry.id)
+            if (
+                playlist.approved is not None
+                and entry.timeslot_end > datetime.datetime.utcnow()
+            ):
+                self._insert(entry)
+            self.changed.notify_all()
+
+    def remove(self, playlist_id):
+        with self.lock:
+            self._remove(playlist_id)
+            self.changed.notify_all()
+
+    def notify(self):
+        """Wake up anything waiting in wait(), e.g. because tracks were added
+        to a playlist."""
+        with self.lock:
+            self.changed.notify_all()
+
+    def next_start(self, queue, now):
+        """Return the start of the next playlist in the given queue that has
+        not started yet, or None."""
+        with self.lock:
+            starts = self.starts.get(queue, [])
+            i = bisect.bisect_right(starts, now)
+            if i < len(starts):
+                return starts[i]
+        return None
+
+    def wait(self, queue, now, timeout):
+        """Block for up to timeout seconds, returning early when the next
+        playlist in the queue is due to start or this worker changes the
+        schedule or a playlist's tracks. Changes made by other workers are not
+        signalled, so callers should check again after a short timeout."""
+        next_start = self.next_start(queue, now)
+        if next_start is not None:
+            timeout = min(timeout, (next_start - now).total_seconds())
+
+        if timeout > 0:
+            with self.lock:
+                self.changed.wait(timeout)
+
+    def current(self, queue, now=None):
+        """Return the playlist on air in the given queue, or None."""
+        if now is None:
+            now = datetime.datetime.utcnow()
+
+        if self.is_stale():
+            self.reload()
+
+        with self.lock:
+            starts = self.starts.get(queue)
+            if not starts:
+                return None
+
+            i = bisect.bisect_right(starts, now) - 1
+            if i < 0:
+                return None
+
+            entry = self.entries[queue][i]
+            if entry.timeslot_end > now:
+                return entry
+
+        return None
+
+
+schedule = ScheduleIndex()
@@ -0,0 +1,171 @@
+import json
+from .cache import TTLCache
+from .es import es
+
+
+# fields returned for each track, in the order of the compact result arrays
+result_fields = ["artist", "title", "album", "label", "length", "url"]
+
+# fields searched by the query text
+query_fields = ["artist", "title", "album", "label"]
+
+# fields results can be sorted and filtered by, through their keyword subfields
+sort_fields = ("artist", "title", "album", "label")
+filter_fields = ("artist", "album", "label")
+
+# how long the field results are tie-broken on is trusted before the songs
+# index mapping is checked again, since an import may have replaced the index
+tiebreak_ttl = 300
+tiebreak_cache = TTLCache(1)
+
+
+def parse_search_args(args, default_size, max_size):
+    """Read the parameters of a search from request arguments, in a
+    normalized form that can also be used as a cache key. Raises ValueError
+    if any of them are invalid."""
+    if "q" not in args:
+        raise ValueError("Missing value for q.")
+
+    if args.get("format", "hits") not in ("hits", "compact"):
+        raise ValueError("Invalid value for format.")
+
+    try:
+        size = int(args.get("size", default_size))
+    except ValueError:
+        raise ValueError("Invalid value for size.")
+    if size < 1 or size > max_size:
+        raise ValueError("Invalid value for size.")
+
+    sort = args.get("sort", "")
+    if sort.lstrip("-") not in sort_fields + ("",):
+        raise ValueError("Invalid value for sort.")
+
+    search_after = None
+    if args.get("search_after"):
+        try:
+            search_after = json.loads(args["search_after"])
+        except ValueError:
+            raise ValueError("Invalid value for search_after.")
+        if not isinstance(search_after, list):
+            raise ValueError("Invalid value for search_after.")
+
+    return {
+        # the query is matched case-insensitively and ignoring extra spaces
+        "q": " ".join(args["q"].lower().split()),
+        "compact": args.get("format") == "compact",
+        "size": size,
+        "sort": sort,
+        "filters": {field: args[field] for field in filter_fields if args.get(field)},
+        "search_after": search_after,
+    }
+
+
+def field_type(mappings, name):
+    """The type of a field in the response to a field mapping request for
+    one index, or None if the index does not have it."""
+    mapping = mappings["mappings"].get(name, {}).get("mapping", {})
+    return mapping.get(name.rsplit(".", 1)[-1], {}).get("type")
+
+
+def tiebreak_field():
+    """The field results are sorted on last, to keep their order stable
+    enough to page through: url, which is unique and mapped as a keyword by
+    songs_mapping. Indices built before that may only have it as a keyword
+    subfield, or not at all; sorting on _id works on those as a last resort,
+    but loads it into memory on every node."""
+    field = tiebreak_cache.get("field")
+    if field is not None:
+        return field
+
+    mappings = es.indices.get_field_mapping(
+        index=es.songs_index, fields=["url", "url.keyword"]
+    )
+    field = "_id"
+    for name in ("url", "url.keyword"):
+        types = [field_type(index, name) for index in mappings.values()]
+        if len(types) > 0 and all(t == "keyword" for t in types):
+            field = name
+            break
+
+    tiebreak_cache.set("field", field, tiebreak_ttl)
+    return field
+
+
+def build_search_body(params, tiebreak="url"):
+    query = {"bool": {}}
+
+    if len(params["q"]) > 0:
+        # unlike query_string, this never fails on unbalanced quotes and the
+        # like, it just ignores them
+        query["bool"]["must"] = {
+            "simple_query_string": {
+                "query": params["q"],
+                "fields": query_fields,
+            },
+        }
+
+    if len(params["filters"]) > 0:
+        query["bool"]["filter"] = [
+            {"term": {"{0}.keyword".format(field): value}}
+            for field, value in sorted(params["filters"].items())
+        ]
+
+    if len(params["sort"]) > 0:
+        field = params["sort"].lstrip("-")
+        order = "desc" if params["sort"].startswith("-") else "asc"
+        sort = [{"{0}.keyword".format(field): order}, {tiebreak: "asc"}]
+    else:
+        sort = [{"_score": "desc"}, {tiebreak: "asc"}]
+
+    body = {
+        "query": query,
+        "sort": sort,
+        "size": params["size"],
+        "_source": result_fields,
+    }
+    if params["search_after"] is not None:
+        body["search_after"] = params["search_after"]
+    return body
+
+
+def search_songs(params):
+    """Search the songs index. Returns Elasticsearch's hits object, as
+    /api/search always has, with the _source of each hit cut down to
+    result_fields. In the compact format, tracks instead come back as arrays
+    of result_fields along with the total number of matches. Either way,
+    next is the search_after value for the next page, or None on the last
+    page."""
+    results = es.search(
+        index=es.songs_index, body=build_search_body(params, tiebreak_field())
+    )
+    hits = results["hits"]["hits"]
+
+    if len(hits) == params["size"]:
+        next_page = hits[-1]["sort"]
+    else:
+        next_page = None
+
+    if not params["compact"]:
+        return dict(results["hits"], next=next_page)
+
+    return {
+        "fields": result_fields,
+        "tracks": [
+            [hit["_source"].get(field) for field in result_fields] for hit in hits
+        ],
+        "total": results["hits"]["total"]["value"],
+        "next": next_page,
+    }
+
+
+def no_results(params):
+    """What search_songs returns when nothing matches."""
+    if not params["compact"]:
+        return {
+            "total": {"value": 0, "relation": "eq"},
+            "max_score": None,
+            "hits": [],
+            "next": None,
+        }
+
+    return {"fields": result_fields, "tracks": [], "total": 0, "next": None}
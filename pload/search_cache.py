@@ -0,0 +1,196 @@
+import datetime
+import json
+import os
+import sqlite3
+import sqlalchemy as sa
+import threading
+import time
+from .cache import TTLCache
+from .db import db
+from .models import SongCatalog
+
+
+song_catalog = SongCatalog.__table__
+
+
+class SearchCache(object):
+    """Cache of search results, keyed by the normalized search parameters
+    and the generation of the song catalog, which import-songs bumps, so that
+    results never outlive the import they came from. Each worker keeps the
+    most recent results in memory; if SEARCH_CACHE_PATH is set, results are
+    also shared between workers through an SQLite file there, which is
+    bounded the same way, least recently used first."""
+
+    # sets between each pass that removes expired and surplus shared entries
+    evict_interval = 100
+
+    def __init__(self, app=None):
+        self.memory = TTLCache(0)
+        self.ttl = 0
+        self.path = None
+        self.shared_size = 0
+        self.generation_ttl = 0
+        self.generation = None
+        self.generation_expires = 0
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.sets = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.memory = TTLCache(app.config["SEARCH_CACHE_SIZE"])
+        self.ttl = app.config["SEARCH_CACHE_TTL"]
+        self.path = app.config["SEARCH_CACHE_PATH"]
+        self.shared_size = app.config["SEARCH_CACHE_SHARED_SIZE"]
+        self.generation_ttl = app.config["SEARCH_CACHE_GENERATION_TTL"]
+
+    def count(self, name, n=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def connect(self):
+        """This thread's connection to the shared cache, made anew in each
+        process since SQLite connections must not cross a fork."""
+        if getattr(self.local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, "
+                "generation INTEGER NOT NULL, value TEXT NOT NULL, "
+                "expires REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_search_cache_last_used "
+                "ON search_cache (last_used)"
+            )
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    def current_generation(self):
+        """The catalog generation, read from the database at most once every
+        SEARCH_CACHE_GENERATION_TTL seconds."""
+        now = time.monotonic()
+        if self.generation is None or now >= self.generation_expires:
+            with db.engine.connect() as conn:
+                generation = conn.execute(
+                    sa.select(song_catalog.c.generation).where(song_catalog.c.id == 1)
+                ).scalar()
+            self.generation = generation if generation is not None else 0
+            self.generation_expires = now + self.generation_ttl
+        return self.generation
+
+    def invalidate(self):
+        """Bump the catalog generation after an import, which makes every
+        worker stop using results cached before it."""
+        now = datetime.datetime.utcnow()
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                sa.update(song_catalog)
+                .where(song_catalog.c.id == 1)
+                .values(generation=song_catalog.c.generation + 1, updated=now)
+            )
+            if result.rowcount == 0:
+                conn.execute(
+                    sa.insert(song_catalog).values(id=1, generation=1, updated=now)
+                )
+
+        self.generation = None
+        self.memory.clear()
+
+    def key(self, params):
+        return (self.current_generation(), json.dumps(params, sort_keys=True))
+
+    def get(self, key):
+        """Return the cached result for a key, or None."""
+        value = self.memory.get(key)
+        if value is not None:
+            self.count("hits")
+            return value
+
+        if self.path is not None:
+            try:
+                value = self.get_shared(key)
+            except sqlite3.Error:
+                value = None
+            if value is not None:
+                self.memory.set(key, value, self.ttl)
+                self.count("shared_hits")
+                return value
+
+        self.count("misses")
+        return None
+
+    def get_shared(self, key):
+        generation, params = key
+        now = time.time()
+        conn = self.connect()
+        row = conn.execute(
+            "SELECT value FROM search_cache "
+            "WHERE key = ? AND generation = ? AND expires > ?",
+            (params, generation, now),
+        ).fetchone()
+        if row is None:
+            return None
+
+        conn.execute(
+            "UPDATE search_cache SET last_used = ? WHERE key = ?", (now, params)
+        )
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        self.memory.set(key, value, self.ttl)
+
+        if self.path is not None:
+            try:
+                self.set_shared(key, value)
+            except sqlite3.Error:
+                pass
+
+    def set_shared(self, key, value):
+        generation, params = key
+        now = time.time()
+        conn = self.connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO search_cache "
+            "(key, generation, value, expires, last_used) VALUES (?, ?, ?, ?, ?)",
+            (params, generation, json.dumps(value), now + self.ttl, now),
+        )
+
+        self.count("sets")
+        if self.sets % self.evict_interval == 0:
+            self.evict(conn, generation, now)
+
+    def evict(self, conn, generation, now):
+        conn.execute(
+            "DELETE FROM search_cache WHERE generation < ? OR expires <= ?",
+            (generation, now),
+        )
+        conn.execute(
+            "DELETE FROM search_cache WHERE key IN (SELECT key FROM search_cache "
+            "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.shared_size,),
+        )
+
+    def stats(self):
+        memory = self.memory.stats()
+        with self.lock:
+            hits = self.hits + self.shared_hits
+            total = hits + self.misses
+            return {
+                "size": memory["size"],
+                "max_size": memory["max_size"],
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total > 0 else 0,
+                "generation": self.generation,
+            }
+
+
+search_cache = SearchCache()
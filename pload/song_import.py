@@ -0,0 +1,339 @@
+import contextlib
+import datetime
+import hashlib
+import json
+import re
+import time
+from elasticsearch.helpers import parallel_bulk, scan
+
+
+required_keys = ["artist", "title", "album", "label", "url"]
+
+# the same fields dynamic mapping would give these, fixed ahead of the first
+# document, except for URLs, which are only ever matched exactly and have no
+# length limit so that long ones can still be looked up
+songs_mapping = {
+    "properties": {
+        "artist": {
+            "type": "text",
+            "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
+        },
+        "title": {
+            "type": "text",
+            "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
+        },
+        "album": {
+            "type": "text",
+            "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
+        },
+        "label": {
+            "type": "text",
+            "fields": {"keyword": {"type": "keyword", "ignore_above": 256}},
+        },
+        "url": {"type": "keyword"},
+        "content_hash": {"type": "keyword", "index": False},
+        "suggest": {"type": "completion"},
+    },
+}
+
+# fields that typeahead suggestions are made from
+suggest_fields = ["artist", "title", "album"]
+
+# the most words into a field that a suggestion may start at
+suggest_max_words = 5
+
+# how much of the file to read at a time
+read_size = 65536
+
+
+def read_json_array(f):
+    """Yield the items of a JSON array, whose opening bracket has already been
+    read from the file, one at a time, reading only as much of the file as
+    needed to decode each one."""
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+
+        if pos < len(buf):
+            if buf[pos] == "]":
+                return
+
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # most likely the item continues in the next chunk
+                if eof:
+                    raise
+            else:
+                # likewise for a number that ends right at the end of the chunk
+                if end < len(buf) or eof:
+                    yield item
+                    pos = end
+                    continue
+        elif eof:
+            raise ValueError("Unexpected end of JSON array")
+
+        chunk = f.read(read_size)
+        eof = len(chunk) == 0
+        buf = buf[pos:] + chunk
+        pos = 0
+
+
+def read_songs(f):
+    """Read song entries from a file holding either a JSON array or one JSON
+    object per line (NDJSON), without loading the whole file."""
+    first = f.read(1)
+    while first.isspace():
+        first = f.read(1)
+
+    if first == "[":
+        yield from read_json_array(f)
+    elif first != "":
+        yield json.loads(first + f.readline())
+        for line in f:
+            if len(line.strip()) > 0:
+                yield json.loads(line)
+
+
+def check_song(entry):
+    for k in required_keys:
+        if entry.get(k) is None:
+            raise ValueError("Malformed songs JSON; missing required key {0}".format(k))
+    return entry
+
+
+def song_id(url):
+    """Document ID of a song, which only depends on its URL, so a song keeps
+    the same document from one import to the next."""
+    return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+
+def content_hash(entry):
+    """Hash of all of a song's fields, to tell whether it has changed."""
+    data = json.dumps(entry, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def suggest_inputs(entry):
+    """Strings a song is suggested for when the user types the start of one:
+    each of its suggest_fields, starting from each of its first few words, so
+    "The Beatles" is also suggested for "bea"."""
+    inputs = []
+    for field in suggest_fields:
+        words = str(entry.get(field) or "").split()
+        for i in range(min(len(words), suggest_max_words)):
+            inputs.append(" ".join(words[i:]))
+    return inputs
+
+
+def song_actions(songs):
+    """Bulk index actions for song entries, checking each one."""
+    for entry in songs:
+        check_song(entry)
+        entry.pop("content_hash", None)
+        entry.pop("suggest", None)
+        yield {
+            "_id": song_id(entry["url"]),
+            **entry,
+            "content_hash": content_hash(entry),
+            "suggest": {"input": suggest_inputs(entry)},
+        }
+
+
+@contextlib.contextmanager
+def bulk_load_settings(client, index):
+    """Turn off refreshes and replicas on an index for the duration of a bulk
+    load, which speeds it up considerably, then restore them and refresh."""
+    current = client.indices.get_settings(index=index, flat_settings=True)
+    settings = current[index]["settings"]
+    previous = {
+        "index.refresh_interval": settings.get("index.refresh_interval"),
+        "index.number_of_replicas": settings.get("index.number_of_replicas"),
+    }
+
+    client.indices.put_settings(
+        index=index,
+        body={"index.refresh_interval": "-1", "index.number_of_replicas": 0},
+    )
+    try:
+        yield
+    finally:
+        # None resets a setting to its default
+        client.indices.put_settings(index=index, body=previous)
+        client.indices.refresh(index=index)
+
+
+def bulk_index(client, index, actions, threads, chunk_size, max_chunk_bytes):
+    """Index documents with several threads sending bulk requests at once.
+    Returns the number of documents indexed and the rate per second."""
+    start = time.monotonic()
+    indexed = 0
+
+    with bulk_load_settings(client, index):
+        for ok, _ in parallel_bulk(
+            client,
+            actions,
+            index=index,
+            thread_count=threads,
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+        ):
+            indexed += 1
+
+    elapsed = time.monotonic() - start
+    return indexed, indexed / elapsed if elapsed > 0 else 0
+
+
+def existing_hashes(client, index):
+    """Content hashes of every document in an index, keyed by ID."""
+    return {
+        hit["_id"]: hit["_source"].get("content_hash")
+        for hit in scan(client, index=index, query={"_source": ["content_hash"]})
+    }
+
+
+def sync_index(client, index, actions, threads, chunk_size, max_chunk_bytes):
+    """Bring a live index in line with a full list of songs, writing only the
+    ones that are new or have changed and then deleting the ones that are no
+    longer listed. Nothing is deleted if reading the songs fails part way.
+    Songs listed more than once are only written the first time. Returns
+    counts of added, updated, unchanged, removed and duplicate songs, and the
+    rate per second at which songs were compared."""
+    start = time.monotonic()
+    existing = existing_hashes(client, index)
+    counts = dict.fromkeys(
+        ("added", "updated", "unchanged", "removed", "duplicates"), 0
+    )
+    seen = set()
+
+    def changed_actions():
+        for action in actions:
+            if action["_id"] in seen:
+                counts["duplicates"] += 1
+                continue
+            seen.add(action["_id"])
+
+            if action["_id"] not in existing:
+                counts["added"] += 1
+            elif existing.pop(action["_id"]) != action["content_hash"]:
+                counts["updated"] += 1
+            else:
+                counts["unchanged"] += 1
+                continue
+            yield action
+
+    def delete_actions():
+        for doc_id in existing:
+            counts["removed"] += 1
+            yield {"_op_type": "delete", "_id": doc_id}
+
+    for changes, ignore_status in ((changed_actions(), ()), (delete_actions(), (404,))):
+        for ok, _ in parallel_bulk(
+            client,
+            changes,
+            index=index,
+            thread_count=threads,
+            chunk_size=chunk_size,
+            max_chunk_bytes=max_chunk_bytes,
+            ignore_status=ignore_status,
+        ):
+            pass
+
+    client.indices.refresh(index=index)
+
+    elapsed = time.monotonic() - start
+    total = counts["added"] + counts["updated"] + counts["unchanged"]
+    return counts, total / elapsed if elapsed > 0 else 0
+
+
+def versioned_index_re(alias):
+    return re.compile(r"^{0}_\d{{20}}$".format(re.escape(alias)))
+
+
+def create_versioned_index(client, alias):
+    """Create an empty index for a new import, named after the alias it will
+    be served under and the time it was created, and return its name."""
+    index = "{0}_{1}".format(
+        alias, datetime.datetime.utcnow().strftime("%Y%m%d%H%M%S%f")
+    )
+    client.indices.create(index=index, body={"mappings": songs_mapping})
+    return index
+
+
+def list_versioned_indices(client, alias):
+    """Names of the indices created for an alias, oldest first."""
+    pattern = versioned_index_re(alias)
+    indices = client.indices.get(index="{0}_*".format(alias))
+    return sorted(index for index in indices if pattern.match(index))
+
+
+def mapping_is_current(client, index):
+    """Whether an index has every field of songs_mapping, with the same type,
+    so that syncing into it gives the same result as building a new one."""
+    mappings = client.indices.get_mapping(index=index)[index]["mappings"]
+    properties = mappings.get("properties", {})
+    return all(
+        properties.get(field, {}).get("type") == spec["type"]
+        for field, spec in songs_mapping["properties"].items()
+    )
+
+
+def alias_indices(client, alias):
+    """Names of the indices an alias currently points to."""
+    if not client.indices.exists_alias(name=alias):
+        return []
+    return sorted(client.indices.get_alias(name=alias).keys())
+
+
+def swap_alias(client, alias, index):
+    """Point an alias at an index, in one atomic update. A concrete index
+    with the alias's name, left over from before imports were versioned, is
+    deleted in the same update."""
+    actions = []
+    if client.indices.exists(index=alias) and not client.indices.exists_alias(
+        name=alias
+    ):
+        actions.append({"remove_index": {"index": alias}})
+    else:
+        for old_index in alias_indices(client, alias):
+            if old_index != index:
+                actions.append({"remove": {"index": old_index, "alias": alias}})
+    actions.append({"add": {"index": index, "alias": alias}})
+
+    client.indices.update_aliases(body={"actions": actions})
+
+
+def gc_indices(client, alias, keep):
+    """Delete all but the newest keep indices that the alias has been moved
+    away from, never touching the ones it points to. Returns the names of the
+    deleted indices."""
+    current = set(alias_indices(client, alias))
+    old = [
+        index for index in list_versioned_indices(client, alias) if index not in current
+    ]
+    deleted = old[: max(len(old) - keep, 0)]
+    for index in deleted:
+        client.indices.delete(index=index)
+    return deleted
+
+
+def rollback_alias(client, alias):
+    """Point the alias back at the newest index older than the one it points
+    to now. Returns the name of that index, or None if there is none."""
+    current = alias_indices(client, alias)
+    if len(current) == 0:
+        return None
+
+    older = [
+        index for index in list_versioned_indices(client, alias) if index < current[0]
+    ]
+    if len(older) == 0:
+        return None
+
+    swap_alias(client, alias, older[-1])
+    return older[-1]
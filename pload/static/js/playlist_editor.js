@@ -1,6 +1,12 @@
 function PlaylistEditor(baseUrl) {
     this.baseUrl = baseUrl;
     this.displayRewrites = [];
+    this.suggestDelay = 150;
+    this.suggestTimer = null;
+    this.suggestRequest = null;
+    this.searchParams = null;
+    this.searchSort = '';
+    this.searchNext = null;
 }
 
 PlaylistEditor.prototype.init = function() {
@@ -58,6 +64,13 @@ PlaylistEditor.prototype.initPlaylist = function() {
                                      this.searchForTracks);
     $("form#playlist_search_form").on('submit', {'instance': this},
                                       this.searchForTracks);
+    $('#playlist_search_form input#q').on('input', {'instance': this},
+                                          this.suggestTracks);
+    $("button#search_more_btn").on('click', {'instance': this}, function(ev) {
+        ev.data.instance.loadSearchResults(true);
+    });
+    $("table#search_results_header th[data-sort]").on('click', {'instance': this},
+                                                      this.sortSearchResults);
 };
 
 PlaylistEditor.prototype.initResizeHandler = function() {
@@ -120,6 +133,7 @@ PlaylistEditor.prototype.dropPlaylistItem = function(ev) {
 
 PlaylistEditor.prototype.loadPlaylist = function(existingTracks) {
     var inst = this;
+    var missingIds = [];
 
     for(let i = 0; i < existingTracks.length; i++) {
         this.playlist.push({
@@ -127,31 +141,47 @@ PlaylistEditor.prototype.loadPlaylist = function(existingTracks) {
             'url': existingTracks[i]['url'],
         });
 
-        // asynchronously load metadata for this track
-        let existingId = existingTracks[i]['id'];
-        $.ajax({
-            url: this.baseUrl + "/api/validate_track",
-            dataType: "json",
-            data: {
-                'url': existingTracks[i]['url'],
-            },
-            success: function(data) {
-                if(data['result'] == true) {
-                    // we need to walk through the entire playlist because the
-                    // order may have changed between the initial load and this
-                    // callback firing
-                    for(var j = 0; j < inst.playlist.length; j++) {
-                        if(inst.playlist[j]['track_id'] == existingId) {
-                            Object.assign(inst.playlist[j], data);
-                        }
-                    }
-                    inst.updatePlaylist();
-                }
-            },
-        });
+        // metadata that was cached is filled in when the page is rendered
+        if(typeof existingTracks[i]['metadata'] == 'object') {
+            Object.assign(this.playlist[this.playlist.length - 1],
+                existingTracks[i]['metadata']);
+        } else {
+            missingIds.push(existingTracks[i]['id']);
+        }
     }
 
     this.updatePlaylist();
+
+    if(missingIds.length == 0) {
+        return;
+    }
+
+    // asynchronously load metadata for the rest, all in one request
+    $.ajax({
+        url: this.baseUrl + "/api/playlists/" + this.playlistId + "/metadata",
+        method: "POST",
+        dataType: "json",
+        data: {
+            'ids': missingIds,
+        },
+        success: function(data) {
+            let metadata = {};
+            for(let i = 0; i < data['tracks'].length; i++) {
+                metadata[data['tracks'][i]['track_id']] = data['tracks'][i];
+            }
+
+            // we need to walk through the entire playlist because the order
+            // may have changed between the initial load and this callback
+            // firing
+            for(let j = 0; j < inst.playlist.length; j++) {
+                let trackId = inst.playlist[j]['track_id'];
+                if(typeof trackId != 'undefined' && trackId in metadata) {
+                    Object.assign(inst.playlist[j], metadata[trackId]);
+                }
+            }
+            inst.updatePlaylist();
+        },
+    });
 };
 
 PlaylistEditor.prototype.updatePlaylist = function() {
@@ -359,28 +389,125 @@ PlaylistEditor.prototype.listTracks = function() {
     return tracks;
 };
 
+PlaylistEditor.prototype.renderSearchResults = function(tracks, append) {
+    if(!append) {
+        $("table#search_results tbody tr").remove();
+    }
+    for(var i = 0; i < tracks.length; i++) {
+        $("table#search_results tbody").append(this.renderTrackRow(
+            tracks[i], 'search_results'));
+    }
+
+    $('table#search_results_header').width($('table#search_results').width());
+};
+
+PlaylistEditor.prototype.cancelSuggestions = function() {
+    clearTimeout(this.suggestTimer);
+    this.suggestTimer = null;
+
+    if(this.suggestRequest != null) {
+        this.suggestRequest.abort();
+        this.suggestRequest = null;
+    }
+};
+
+PlaylistEditor.prototype.suggestTracks = function(ev) {
+    var inst = ev.data.instance;
+    inst.cancelSuggestions();
+
+    // wait for a pause in typing, so only the last keystroke is looked up
+    inst.suggestTimer = setTimeout(function() {
+        var q = $('#playlist_search_form input#q').val();
+        if(q.trim().length == 0) {
+            return;
+        }
+
+        inst.suggestRequest = $.ajax({
+            method: "GET",
+            url: inst.baseUrl + "/api/suggest",
+            dataType: "json",
+            data: {
+                "q": q,
+            },
+            success: function(data) {
+                inst.suggestRequest = null;
+                $("button#search_more_btn").addClass('d-none');
+                inst.renderSearchResults(data['tracks']);
+            },
+        });
+    }, inst.suggestDelay);
+};
+
 PlaylistEditor.prototype.searchForTracks = function(ev) {
     var inst = ev.data.instance;
 
     // don't submit form
     ev.preventDefault();
 
+    inst.searchParams = {
+        "q": $('#playlist_search_form input#q').val(),
+        "sort": inst.searchSort,
+        "format": "compact",
+    };
+    inst.loadSearchResults(false);
+};
+
+PlaylistEditor.prototype.sortSearchResults = function(ev) {
+    var inst = ev.data.instance;
+    var th = $(this);
+
+    // cycle through ascending, descending and back to relevance
+    var field = th.attr('data-sort');
+    if(inst.searchSort == field) {
+        inst.searchSort = '-' + field;
+    } else if(inst.searchSort == '-' + field) {
+        inst.searchSort = '';
+    } else {
+        inst.searchSort = field;
+    }
+
+    $("table#search_results_header th[data-sort] span.oi").remove();
+    if(inst.searchSort != '') {
+        th.append($("<span class='oi'>").addClass(
+            inst.searchSort == field ? 'oi-caret-top' : 'oi-caret-bottom'));
+    }
+
+    if(inst.searchParams != null) {
+        inst.searchParams['sort'] = inst.searchSort;
+        inst.loadSearchResults(false);
+    }
+};
+
+PlaylistEditor.prototype.loadSearchResults = function(append) {
+    var inst = this;
+    var data = $.extend({}, this.searchParams);
+    if(append) {
+        data['search_after'] = JSON.stringify(this.searchNext);
+    }
+
+    this.cancelSuggestions();
+
     $.ajax({
         method: "GET",
-        url: inst.baseUrl + "/api/search",
+        url: this.baseUrl + "/api/search",
         dataType: "json",
-        data: {
-            "q": $('#playlist_search_form input#q').val(),
-        },
+        data: data,
         success: function(data) {
-            $("table#search_results tbody tr").remove();
-            for(var i = 0; i < data['hits'].length; i++) {
-                var result = data['hits'][i];
-                $("table#search_results tbody").append(inst.renderTrackRow(
-                    result['_source'], 'search_results'));
+            // each track is an array of the listed fields
+            var tracks = [];
+            for(var i = 0; i < data['tracks'].length; i++) {
+                var track = {};
+                for(var j = 0; j < data['fields'].length; j++) {
+                    if(data['tracks'][i][j] != null) {
+                        track[data['fields'][j]] = data['tracks'][i][j];
+                    }
+                }
+                tracks.push(track);
             }
+            inst.renderSearchResults(tracks, append);
 
-            $('table#search_results_header').width($('table#search_results').width());
+            inst.searchNext = data['next'];
+            $("button#search_more_btn").toggleClass('d-none', data['next'] == null);
         },
     });
 };
@@ -410,89 +537,90 @@ PlaylistEditor.prototype.initImport = function() {
         }
 
         var playlistFile = uploadControl.files[0];
-        if(playlistFile.type != "audio/x-mpegurl" && !playlistFile.type.startsWith("text/")) {
+        if(playlistFile.type != "audio/x-mpegurl" && playlistFile.type != "audio/mpegurl" &&
+                playlistFile.type != "audio/x-scpls" && playlistFile.type != "" &&
+                !playlistFile.type.startsWith("text/")) {
             alert("The playlist file does not appear to be the correct file type.");
             return;
         }
 
-        var reader = new FileReader();
-
-        // Heads up, this is a little bit complex as it uses some modern ES6+
-        // magic to work!
-        //
-        // We wrap the whole onload event handler in an anonymous function to
-        // past in an instance of PlaylistEditor. Then, the event handler
-        // itself uses async/await to handle tracks in the playlist serially.
-        // Basically, what happens is calling processPlaylist (an async
-        // function) runs processPlaylist without blocking the event handler.
-        //
-        // Inside processPlaylist, we loop through the list like normal, but
-        // instead of passing a callback to $.ajax, we use await with it. This
-        // pauses processing until that call returns and we get a result back.
-        //
-        // We check the value of the result; if the track is valid, just add
-        // it to the playlist. If not, display an alert to the user and abort.
-        // It's on them to manually remove tracks if something went horribly
-        // wrong with the import.
-        reader.onload = (function(inst) {
-            return function(ev) {
-                async function processPlaylist(playlist) {
-                    let totalTracks = 0;
-
-                    for(let i = 0; i < playlist.length; i++) {
-                        // skip empty lines
-                        if(playlist[i].length <= 0) {
-                            continue;
-                        }
-
-                        // skip comments
-                        if(playlist[i].startsWith('#')) {
-                            continue;
-                        }
-
-                        let newTrack = {
-                            "url": playlist[i],
-                        };
-
-                        let errorMsg = "Track failed to validate: " + newTrack['url'] + "\n\nAdditional processing has been halted, but tracks that were imported up until this point will need to be manually removed.";
-                        let result;
-
-                        try {
-                            result = await $.ajax({
-                                url: inst.baseUrl + "/api/validate_track",
-                                dataType: "json",
-                                data: newTrack,
-                            });
-                        } catch(error) {
-                            alert(errorMsg);
-                            $('#save_changes_btn').prop('disabled', false);
-                            return;
-                        }
-
-                        if(result['result'] == true) {
-                            inst.playlist.push(result);
-                            inst.updatePlaylist();
-
-                            totalTracks++;
-                        } else {
-                            alert(errorMsg);
-                            $('#save_changes_btn').prop('disabled', false);
-                            return;
-                        }
-                    }
+        // the editor only ever works on a saved playlist, which the server
+        // imports into directly
+        inst.importToPlaylist(playlistFile);
+    });
+};
 
-                    inst.showAlert(totalTracks + " tracks imported.", 'info');
-                    $('#save_changes_btn').prop('disabled', false);
+PlaylistEditor.prototype.importToPlaylist = function(playlistFile) {
+    var inst = this;
+    var formData = new FormData();
+    formData.append('file', playlistFile);
+
+    $('#save_changes_btn').prop('disabled', true);
+    $('#import_m3u_modal').modal('hide');
+    var progressAlert = inst.showAlert("Importing " + playlistFile.name + "...", 'info');
+
+    // The server validates the tracks and reports its progress as one JSON
+    // object per line. Nothing is added to the playlist unless every track
+    // passes, so a bad line never leaves a partial import behind.
+    var failed = [];
+    var handleEvent = function(ev) {
+        if(ev['event'] == 'error') {
+            failed.push("Line " + ev['line'] + ": " + ev['url']);
+        } else if(ev['event'] == 'progress') {
+            progressAlert.remove();
+            progressAlert = inst.showAlert(ev['validated'] + " tracks checked, " + ev['failed'] + " failed...", 'info');
+        } else if(ev['event'] == 'done') {
+            progressAlert.remove();
+            if(ev['success']) {
+                for(let i = 0; i < ev['tracks'].length; i++) {
+                    inst.playlist.push(ev['tracks'][i]);
                 }
+                inst.updatePlaylist();
+                inst.showAlert(ev['tracks'].length + " tracks imported and saved.", 'info');
+            } else if(failed.length > 0) {
+                alert(ev['message'] + "\n\n" + failed.join("\n"));
+            } else {
+                alert(ev['message']);
+            }
+        }
+    };
 
-                var newPlaylist = ev.target.result.split(/\r\n|\n|\r/);
-                processPlaylist(newPlaylist);
+    fetch(inst.baseUrl + "/api/playlists/" + inst.playlistId + "/import", {
+        method: "POST",
+        body: formData,
+        headers: {'X-Requested-With': 'XMLHttpRequest'},
+        credentials: 'same-origin',
+    }).then(function(response) {
+        if(!response.ok) {
+            throw new Error(response.statusText);
+        }
 
-                $('#save_changes_btn').prop('disabled', true);
-                $('#import_m3u_modal').modal('hide');
-            }
-        })(inst);
-        reader.readAsText(playlistFile);
+        var reader = response.body.getReader();
+        var decoder = new TextDecoder();
+        var buffer = "";
+
+        var read = function() {
+            return reader.read().then(function(result) {
+                buffer += decoder.decode(result.value || new Uint8Array(), {'stream': !result.done});
+
+                var lines = buffer.split("\n");
+                buffer = lines.pop();
+                for(let i = 0; i < lines.length; i++) {
+                    if(lines[i].length > 0) {
+                        handleEvent(JSON.parse(lines[i]));
+                    }
+                }
+
+                if(!result.done) {
+                    return read();
+                }
+            });
+        };
+        return read();
+    }).catch(function(err) {
+        alert("An error occurred while importing the playlist.");
+    }).then(function() {
+        $('#save_changes_btn').prop('disabled', false);
     });
 };
 
@@ -517,4 +645,5 @@ PlaylistEditor.prototype.showAlert = function(msg, severity) {
 
     $('#playlist_alerts').append(alertDiv);
     alertDiv.show('fast');
+    return alertDiv;
 };
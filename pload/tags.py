@@ -0,0 +1,179 @@
+import io
+import mutagen
+import re
+import requests.exceptions
+import tempfile
+import urllib.parse
+from .http_session import http_session
+
+
+content_range_re = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """Read-only, seekable file object for a remote file that only downloads
+    the parts that are actually read, using HTTP Range requests. Fetched data
+    is kept in memory in fixed-size blocks."""
+
+    def __init__(self, url, size, block_size, first_block=b""):
+        super().__init__()
+        self.url = url
+        self.size = size
+        self.block_size = block_size
+        self.position = 0
+        self.blocks = {}
+        self.requests_made = 0
+
+        # mutagen uses the name to help guess the file type
+        self.name = urllib.parse.urlsplit(url).path.rsplit("/", 1)[-1]
+
+        if len(first_block) > 0:
+            self._store(0, first_block)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("Invalid whence")
+
+        if position < 0:
+            raise OSError("Negative seek position")
+
+        self.position = position
+        return self.position
+
+    def _store(self, start, data):
+        for offset in range(0, len(data), self.block_size):
+            index = (start + offset) // self.block_size
+            self.blocks[index] = data[offset : offset + self.block_size]
+
+    def _fetch(self, first, last):
+        """Download blocks first through last (inclusive) in one request."""
+        start = first * self.block_size
+        end = min((last + 1) * self.block_size, self.size) - 1
+
+        self.requests_made += 1
+        r = http_session.get(
+            self.url,
+            headers={
+                "Range": "bytes={0:d}-{1:d}".format(start, end),
+                "Accept-Encoding": "identity",
+            },
+        )
+        r.raise_for_status()
+        if r.status_code != 206:
+            raise OSError("Server stopped honoring Range requests")
+
+        self._store(start, r.content)
+
+    def readinto(self, b):
+        if self.position >= self.size:
+            return 0
+
+        end = min(self.position + len(b), self.size)
+        first = self.position // self.block_size
+        last = (end - 1) // self.block_size
+
+        # fetch each run of missing blocks with a single request
+        missing_start = None
+        for index in range(first, last + 2):
+            if index <= last and index not in self.blocks:
+                if missing_start is None:
+                    missing_start = index
+            elif missing_start is not None:
+                try:
+                    self._fetch(missing_start, index - 1)
+                except requests.exceptions.RequestException as e:
+                    raise OSError(e)
+                missing_start = None
+
+        data = b"".join(self.blocks[index] for index in range(first, last + 1))
+        offset = self.position - first * self.block_size
+        data = data[offset : offset + end - self.position]
+
+        b[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+def open_remote_file(url, block_size=65536):
+    """Open a remote file for reading tags. Returns an HTTPRangeFile if the
+    server supports Range requests; otherwise the whole file is downloaded to
+    a temporary file, which is returned instead. Either way, the file has etag
+    and last_modified attributes taken from the response headers."""
+    r = http_session.get(
+        url,
+        headers={
+            "Range": "bytes=0-{0:d}".format(block_size - 1),
+            "Accept-Encoding": "identity",
+        },
+        stream=True,
+    )
+    r.raise_for_status()
+
+    m = None
+    if r.status_code == 206:
+        m = content_range_re.match(r.headers.get("Content-Range", ""))
+
+    if m is not None:
+        first_block = r.content
+        f = HTTPRangeFile(url, int(m.group(3)), block_size, first_block)
+    else:
+        # the server ignored the Range header, so we get the whole file
+        ext = url.rsplit(".", 1)[-1]
+        f = tempfile.NamedTemporaryFile(suffix="." + ext)
+        try:
+            for chunk in r.iter_content(chunk_size=65536):
+                if chunk:
+                    f.write(chunk)
+        finally:
+            r.close()
+        f.seek(0, 0)
+
+    f.etag = r.headers.get("ETag")
+    f.last_modified = r.headers.get("Last-Modified")
+    return f
+
+
+def read_file_tags(f):
+    """Read artist, title, album, label, bitrate, sample rate and length from
+    an open audio file, such as one from open_remote_file. Returns whatever
+    could be found, which may be nothing if the file cannot be parsed."""
+    result = {}
+
+    try:
+        m = mutagen.File(f, easy=True)
+    except (mutagen.MutagenError, OSError):
+        return result
+
+    if m is not None:
+        tags_to_copy = ("artist", "title", "album", "label")
+        for tag in tags_to_copy:
+            if m.get(tag) is not None and len(m.get(tag)) > 0:
+                result[tag] = m[tag][0]
+
+        try:
+            result.update(
+                {
+                    "bitrate": m.info.bitrate // 1000,
+                    "sample": m.info.sample_rate,
+                    "length": int(m.info.length),
+                }
+            )
+        except AttributeError:
+            pass
+
+    return result
@@ -0,0 +1,321 @@
+import datetime
+import sqlalchemy as sa
+import uuid
+from .db import db
+from .models import Playlist, QueuedTrack
+
+
+playlist = Playlist.__table__
+queued_track = QueuedTrack.__table__
+
+
+def uses_returning():
+    """PostgreSQL lets us claim rows with a single UPDATE ... RETURNING;
+    elsewhere (SQLite for development) we fall back to compare-and-set."""
+    return db.engine.dialect.name == "postgresql"
+
+
+def expired_lease(playlist_id, now):
+    """Tracks behind the cursor that were leased but neither confirmed nor
+    renewed in time. These go back to the queue ahead of the cursor."""
+    return sa.and_(
+        queued_track.c.playlist_id == playlist_id,
+        queued_track.c.played == False,
+        queued_track.c.lease_expires != None,
+        queued_track.c.lease_expires <= now,
+    )
+
+
+def on_air(now):
+    """The playlist is still approved and within its timeslot. Each worker's
+    schedule index can lag behind edits made through another worker, so
+    every claim checks this against the playlist row itself."""
+    return sa.and_(
+        playlist.c.approved != None,
+        playlist.c.timeslot_start <= now,
+        playlist.c.timeslot_end > now,
+    )
+
+
+def playlist_on_air(playlist_id, now):
+    return sa.exists().where(playlist.c.id == playlist_id, on_air(now))
+
+
+def claim_next_track(playlist_id):
+    """Mark the next track in a playlist as played and return its URL, or None
+    if every track has been handed out or the playlist is no longer on air.
+    Each track is handed out exactly once, even with several pollers claiming
+    from the same playlist."""
+    now = datetime.datetime.utcnow()
+
+    if uses_returning():
+        url = _claim_expired_returning(playlist_id, now)
+    else:
+        url = _claim_expired_cas(playlist_id, now)
+
+    if url is None:
+        if uses_returning():
+            url = _claim_at_cursor_returning(playlist_id, now)
+        else:
+            positions = _advance_cursor(playlist_id, 1, now)
+            if positions is not None:
+                url = _mark_played(playlist_id, positions[0])
+
+    db.session.commit()
+    return url
+
+
+def _claim_expired_returning(playlist_id, now):
+    next_id = (
+        sa.select(queued_track.c.id)
+        .where(expired_lease(playlist_id, now))
+        .order_by(queued_track.c.position)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+
+    return db.session.execute(
+        sa.update(queued_track)
+        .where(queued_track.c.id == next_id, playlist_on_air(playlist_id, now))
+        .values(played=True, lease_token=None, lease_expires=None)
+        .returning(queued_track.c.url)
+    ).scalar()
+
+
+def _claim_expired_cas(playlist_id, now):
+    while True:
+        row = db.session.execute(
+            sa.select(queued_track.c.id, queued_track.c.url)
+            .where(expired_lease(playlist_id, now), playlist_on_air(playlist_id, now))
+            .order_by(queued_track.c.position)
+            .limit(1)
+        ).first()
+        if row is None:
+            return None
+
+        # only succeeds if nobody else claimed this track since we read it
+        result = db.session.execute(
+            sa.update(queued_track)
+            .where(
+                queued_track.c.id == row.id,
+                expired_lease(playlist_id, now),
+                playlist_on_air(playlist_id, now),
+            )
+            .values(played=True, lease_token=None, lease_expires=None)
+        )
+        if result.rowcount == 1:
+            return row.url
+
+        db.session.commit()
+
+
+def _claim_at_cursor_returning(playlist_id, now):
+    # the row lock taken by this UPDATE serializes concurrent pollers
+    position = db.session.execute(
+        sa.update(playlist)
+        .where(
+            playlist.c.id == playlist_id,
+            on_air(now),
+            sa.exists().where(
+                queued_track.c.playlist_id == playlist.c.id,
+                queued_track.c.position == playlist.c.cursor,
+            ),
+        )
+        .values(cursor=playlist.c.cursor + 1)
+        .returning(playlist.c.cursor - 1)
+    ).scalar()
+    if position is None:
+        return None
+
+    return db.session.execute(
+        sa.update(queued_track)
+        .where(
+            queued_track.c.playlist_id == playlist_id,
+            queued_track.c.position == position,
+        )
+        .values(played=True)
+        .returning(queued_track.c.url)
+    ).scalar()
+
+
+def _advance_cursor(playlist_id, count, now):
+    """Move the cursor forward by up to count tracks, stopping at the end of
+    the playlist. Returns the range of positions handed out, or None, which
+    is also the answer once the playlist is no longer on air."""
+    while True:
+        cursor = db.session.execute(
+            sa.select(playlist.c.cursor)
+            .where(playlist.c.id == playlist_id, on_air(now))
+            .with_for_update()
+        ).scalar()
+        if cursor is None:
+            return None
+
+        total = db.session.execute(
+            sa.select(sa.func.count(queued_track.c.id)).where(
+                queued_track.c.playlist_id == playlist_id
+            )
+        ).scalar()
+        end = min(cursor + count, total)
+        if end <= cursor:
+            return None
+
+        # the row lock makes this a formality on PostgreSQL; elsewhere it
+        # catches a concurrent poller moving the cursor since we read it
+        result = db.session.execute(
+            sa.update(playlist)
+            .where(
+                playlist.c.id == playlist_id,
+                playlist.c.cursor == cursor,
+                on_air(now),
+            )
+            .values(cursor=end)
+        )
+        if result.rowcount == 1:
+            return cursor, end
+
+        db.session.commit()
+
+
+def _mark_played(playlist_id, position):
+    db.session.execute(
+        sa.update(queued_track)
+        .where(
+            queued_track.c.playlist_id == playlist_id,
+            queued_track.c.position == position,
+        )
+        .values(played=True)
+    )
+    return db.session.execute(
+        sa.select(queued_track.c.url).where(
+            queued_track.c.playlist_id == playlist_id,
+            queued_track.c.position == position,
+        )
+    ).scalar()
+
+
+def lease_tracks(playlist_id, count, lease_time):
+    """Reserve up to count of the next tracks in a playlist for lease_time
+    seconds. Returns the lease token, its expiry, and a list of (id, url)
+    tuples in play order; the list is empty if nothing is left."""
+    now = datetime.datetime.utcnow()
+    token = uuid.uuid4().hex
+    expires = now + datetime.timedelta(seconds=lease_time)
+
+    # tracks from expired leases come first, since they are earliest
+    expired_ids = (
+        sa.select(queued_track.c.id)
+        .where(expired_lease(playlist_id, now))
+        .order_by(queued_track.c.position)
+        .limit(count)
+    )
+    if uses_returning():
+        expired_ids = expired_ids.with_for_update(skip_locked=True).scalar_subquery()
+    else:
+        expired_ids = db.session.execute(expired_ids).scalars().all()
+
+    # rows someone else grabbed in the meantime no longer match, so the lease
+    # simply ends up shorter
+    result = db.session.execute(
+        sa.update(queued_track)
+        .where(
+            queued_track.c.id.in_(expired_ids),
+            expired_lease(playlist_id, now),
+            playlist_on_air(playlist_id, now),
+        )
+        .values(lease_token=token, lease_expires=expires)
+    )
+
+    if result.rowcount < count:
+        positions = _advance_cursor(playlist_id, count - result.rowcount, now)
+        if positions is not None:
+            db.session.execute(
+                sa.update(queued_track)
+                .where(
+                    queued_track.c.playlist_id == playlist_id,
+                    queued_track.c.position >= positions[0],
+                    queued_track.c.position < positions[1],
+                )
+                .values(lease_token=token, lease_expires=expires)
+            )
+
+    rows = db.session.execute(
+        sa.select(queued_track.c.id, queued_track.c.url)
+        .where(queued_track.c.lease_token == token)
+        .order_by(queued_track.c.position)
+    ).all()
+
+    db.session.commit()
+    return token, expires, [(row.id, row.url) for row in rows]
+
+
+def confirm_leased_track(token, track_id):
+    """Mark a leased track as played. Returns False if the track is not held
+    by this lease, e.g. because it expired and was handed out again."""
+    result = db.session.execute(
+        sa.update(queued_track)
+        .where(
+            queued_track.c.id == track_id,
+            queued_track.c.lease_token == token,
+            queued_track.c.played == False,
+        )
+        .values(played=True, lease_token=None, lease_expires=None)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def release_lease(token):
+    """Return every unconfirmed track in a lease to the queue by expiring the
+    lease right away."""
+    result = db.session.execute(
+        sa.update(queued_track)
+        .where(
+            queued_track.c.lease_token == token,
+            queued_track.c.played == False,
+        )
+        .values(lease_expires=datetime.datetime.utcnow())
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def update_tracks(playlist_id, moved, removed, added):
+    """Apply changes to the tracks in a playlist with one bulk statement
+    each: moved is a list of (id, new position) tuples, removed a list of
+    IDs, and added a list of (url, position) tuples. The caller commits."""
+    if len(removed) > 0:
+        db.session.execute(
+            sa.delete(queued_track).where(
+                queued_track.c.playlist_id == playlist_id,
+                queued_track.c.id.in_(removed),
+            )
+        )
+
+    if len(moved) > 0:
+        # positions are not unique while this runs, so the order the rows are
+        # updated in does not matter
+        db.session.execute(
+            sa.update(queued_track)
+            .where(queued_track.c.id == sa.bindparam("track_id"))
+            .values(position=sa.bindparam("new_position")),
+            [
+                {"track_id": track_id, "new_position": position}
+                for track_id, position in moved
+            ],
+        )
+
+    if len(added) > 0:
+        db.session.execute(
+            sa.insert(queued_track),
+            [
+                {
+                    "url": url,
+                    "playlist_id": playlist_id,
+                    "position": position,
+                    "played": False,
+                }
+                for url, position in added
+            ],
+        )
@@ -0,0 +1,75 @@
+import collections
+import requests.exceptions
+from .cache import TTLCache
+from .http_session import http_session
+
+
+URLStatus = collections.namedtuple("URLStatus", ["exists", "etag", "last_modified"])
+
+# statuses that say a file is really not there, rather than that the server
+# could not tell us right now
+missing_statuses = (404, 410)
+
+
+class URLChecker(object):
+    """Checks whether track URLs exist without downloading them, remembering
+    the answer so that saving the same playlist again does not hit the file
+    servers. URLs that exist are cached for TRACK_VALIDATE_CACHE_TTL seconds
+    and then revalidated with a conditional request; URLs that the server
+    says are gone (404 or 410) are cached for
+    TRACK_VALIDATE_NEGATIVE_CACHE_TTL seconds. Any other failure is not
+    cached at all, and a URL that was known to exist is still trusted while
+    its server is failing."""
+
+    def __init__(self, app=None):
+        self.cache = TTLCache()
+        self.ttl = 0
+        self.negative_ttl = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.cache = TTLCache(app.config["TRACK_VALIDATE_CACHE_SIZE"])
+        self.ttl = app.config["TRACK_VALIDATE_CACHE_TTL"]
+        self.negative_ttl = app.config["TRACK_VALIDATE_NEGATIVE_CACHE_TTL"]
+
+    def exists(self, url):
+        cached, fresh = self.cache.lookup(url)
+        if fresh:
+            return cached.exists
+
+        headers = {}
+        if cached is not None and cached.exists:
+            if cached.etag is not None:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified is not None:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        try:
+            r = http_session.head(url, headers=headers, allow_redirects=True)
+            if r.status_code in (405, 501):
+                # HEAD is not supported, so ask for as little as possible
+                headers["Range"] = "bytes=0-0"
+                r = http_session.get(url, headers=headers, stream=True)
+                r.close()
+        except requests.exceptions.RequestException:
+            r = None
+
+        if r is not None and r.status_code == 304:
+            status = cached
+        elif r is not None and r.ok:
+            status = URLStatus(
+                True, r.headers.get("ETag"), r.headers.get("Last-Modified")
+            )
+        elif r is not None and r.status_code in missing_statuses:
+            status = URLStatus(False, None, None)
+        else:
+            # most likely temporary, so check again next time
+            return cached is not None and cached.exists
+
+        self.cache.set(url, status, self.ttl if status.exists else self.negative_ttl)
+        return status.exists
+
+
+url_checker = URLChecker()
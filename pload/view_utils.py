@@ -1,13 +1,16 @@
-import re
+import collections
 import requests
 import requests.exceptions
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from dateutil.tz import gettz
 from flask import current_app, make_response, request
 from functools import wraps
 from .exceptions import PlaylistValidationException
-
-
-annotate_split_re = re.compile(r":(?=(?:[^\"]*\"[^\"]*\")*[^\"]*$)")
+from .http_session import http_session
+from .liquidsoap import LiquidsoapURI
+from .rewrite import display_url_rewriter, file_url_rewriter
+from .url_check import url_checker
 
 
 def require_auth(f):
@@ -37,56 +40,41 @@ def get_slot_tz():
     return gettz(current_app.config["TIME_SLOT_TZ"])
 
 
+def is_http_url(url):
+    return url[0:7] == "http://" or url[0:8] == "https://"
+
+
 def validate_url(url):
-    if url[0:7] != "http://" and url[0:8] != "https://":
+    if not is_http_url(url):
         return False
 
     if current_app.config["TRACK_VALIDATE_CHECK_EXISTS"]:
-        try:
-            r = requests.get(url)
-            r.raise_for_status()
-        except requests.exceptions.RequestException:
-            return False
+        return url_checker.exists(url)
 
     return True
 
 
 def get_file_url(url):
     """Get the actual file URL, stripping any Liquidsoap-specific protocols and
-    rewriting as necessary."""
-    if url.startswith("annotate:"):
-        frags = annotate_split_re.split(url, 2)
-        return get_file_url(frags[2])
-    elif url.startswith("ffmpeg:") or url.startswith("replay_gain:"):
-        frags = url.split(":", 1)
-        return get_file_url(frags[1])
-    elif url[0:7] == "http://" or url[0:8] == "https://":
-        url = requests.utils.requote_uri(url)
-        for pattern, replacement in current_app.config["TRACK_URL_REWRITES"]:
-            pattern_re = re.compile(pattern)
-            url = pattern_re.sub(replacement, url)
-        return url
+    rewriting as necessary. Raises ValueError for malformed annotations."""
+    file_url = LiquidsoapURI.parse(url).url
+    if is_http_url(file_url):
+        return file_url_rewriter.rewrite(requests.utils.requote_uri(file_url))
     else:
-        return url
+        return file_url
 
 
 def process_url(url, skip_validate=False):
-    if url.startswith("annotate:"):
-        frags = annotate_split_re.split(url, 2)
-        frags[2] = process_url(url, skip_validate)
-        return ":".join(frags)
-    elif url.startswith("ffmpeg:") or url.startswith("replay_gain:"):
-        frags = url.split(":", 1)
-        frags[1] = process_url(url, skip_validate)
-        return ":".join(frags)
-    elif url[0:7] == "http://" or url[0:8] == "https://":
-        url = requests.utils.requote_uri(url)
-        for pattern, replacement in current_app.config["TRACK_URL_REWRITES"]:
-            pattern_re = re.compile(pattern)
-            url = pattern_re.sub(replacement, url)
-        if not skip_validate and not validate_url(url):
+    try:
+        uri = LiquidsoapURI.parse(url)
+    except ValueError:
+        raise PlaylistValidationException()
+
+    if is_http_url(uri.url):
+        uri.url = file_url_rewriter.rewrite(requests.utils.requote_uri(uri.url))
+        if not skip_validate and not validate_url(uri.url):
             raise PlaylistValidationException()
-        return url
+        return str(uri)
     else:
         if not skip_validate:
             raise PlaylistValidationException()
@@ -94,16 +82,62 @@ def process_url(url, skip_validate=False):
             return url
 
 
+def try_process_url(url):
+    """Like process_url, but returns None for URLs that fail validation."""
+    try:
+        return process_url(url)
+    except PlaylistValidationException:
+        return None
+
+
+def map_by_host(func, urls):
+    """Call func on each URL concurrently and return the results in order.
+    At most TRACK_VALIDATE_PER_HOST calls are in flight for any one host, so
+    a long playlist does not hammer a single file server."""
+    app = current_app._get_current_object()
+
+    # group the work by host so each host gets its own capped set of workers,
+    # rather than having workers sit idle waiting on a busy host
+    queues = collections.OrderedDict()
+    for index, url in enumerate(urls):
+        try:
+            host = urllib.parse.urlsplit(get_file_url(url)).netloc
+        except ValueError:
+            # malformed; func will have to deal with it
+            host = ""
+        queues.setdefault(host, collections.deque()).append((index, url))
+
+    results = [None] * len(urls)
+
+    def drain(queue):
+        with app.app_context():
+            while True:
+                try:
+                    index, url = queue.popleft()
+                except IndexError:
+                    return
+                results[index] = func(url)
+
+    per_host = app.config["TRACK_VALIDATE_PER_HOST"]
+    drains = [
+        queue for queue in queues.values() for _ in range(min(per_host, len(queue)))
+    ]
+    if len(drains) > 0:
+        workers = min(app.config["TRACK_VALIDATE_WORKERS"], len(drains))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in [executor.submit(drain, queue) for queue in drains]:
+                future.result()
+
+    return results
+
+
 def process_url_for_display(url):
-    for pattern, replacement in current_app.config["TRACK_URL_DISPLAY_REWRITES"]:
-        pattern_re = re.compile(pattern)
-        url = pattern_re.sub(replacement, url)
-    return url
+    return display_url_rewriter.rewrite(url)
 
 
 def get_dj_list():
     try:
-        r = requests.get(
+        r = http_session.get(
             "{0}/api/playlists/dj".format(
                 current_app.config["TRACKMAN_URL"].rstrip("/")
             )
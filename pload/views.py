@@ -1,4 +1,4 @@
-from collections import defaultdict
+from collections import defaultdict, deque
 from dateutil.tz import gettz, UTC
 import datetime
 from flask import (
@@ -9,51 +9,92 @@ from flask import (
     jsonify,
     render_template,
     request,
+    Response,
+    stream_with_context,
 )
 from .db import db
-from .exceptions import PlaylistValidationException
+from .export import generate_m3u8, generate_zip, playlist_etag
 from .filters import localize_datetime
 from .forms import CreatePlaylistForm
+from .metadata import get_cached_tracks_metadata
 from .models import Playlist, QueuedTrack
-from .view_utils import process_url, get_dj_list
+from .schedule import schedule, to_naive_utc
+from .track_queue import update_tracks
+from .view_utils import get_dj_list, get_slot_tz, map_by_host, try_process_url
 
 
 bp = Blueprint("pload", __name__)
 
 
-@bp.route("/")
-def index():
-    djs = get_dj_list()
-    dj_map = {int(dj["id"]): dj["airname"] for dj in djs}
-    dj_map[1] = "Automation"
-
-    tracks_sq = (
-        QueuedTrack.query.with_entities(
-            QueuedTrack.playlist_id,
-            db.func.count(QueuedTrack.playlist_id).label("count"),
-        )
-        .group_by(QueuedTrack.playlist_id)
-        .subquery()
+def upcoming_playlists_query(now):
+    """Approved playlists that have not ended yet, with their track counts."""
+    # counted per playlist so that only the tracks of upcoming playlists are
+    # read, using the index on queued_track.playlist_id
+    track_count = (
+        db.select(db.func.count(QueuedTrack.id))
+        .where(QueuedTrack.playlist_id == Playlist.id)
+        .correlate(Playlist)
+        .scalar_subquery()
     )
 
-    playlists = (
+    return (
         Playlist.query.with_entities(
             Playlist.id,
             Playlist.timeslot_start,
             Playlist.timeslot_end,
             Playlist.queue,
             Playlist.dj_id,
-            tracks_sq.c.count,
+            track_count,
         )
-        .outerjoin(tracks_sq, tracks_sq.c.playlist_id == Playlist.id)
         .filter(
-            Playlist.timeslot_end >= datetime.datetime.utcnow(),
+            Playlist.timeslot_end >= now,
             Playlist.approved != None,
         )
         .order_by(Playlist.timeslot_start)
-        .all()
     )
 
+
+def overlapping_playlists_query(timeslot_start, timeslot_end, queue):
+    """Approved playlists in the same queue that overlap the given slot."""
+    return Playlist.query.filter(
+        db.or_(
+            # The new playlist is either exactly at the same time as an
+            # existing playlist or there's an existing playlist entirely
+            # inside the same time slot
+            db.and_(
+                # An existing playlist starts after (inclusive) we do
+                Playlist.timeslot_start >= timeslot_start,
+                # AND that playlist ends before (inclusive) we do
+                Playlist.timeslot_end <= timeslot_end,
+            ),
+            # The new playlist will start before an existing playlist ends
+            db.and_(
+                # An existing playlist starts before (inclusive) we do
+                Playlist.timeslot_start <= timeslot_start,
+                # AND that playlist ends after we start
+                Playlist.timeslot_end > timeslot_start,
+            ),
+            # The new playlist will end after an existing playlist starts
+            db.and_(
+                # An existing playlist starts after (inclusive) we do
+                Playlist.timeslot_start >= timeslot_start,
+                # AND that playlist starts before we end
+                Playlist.timeslot_start < timeslot_end,
+            ),
+        ),
+        Playlist.queue == queue,
+        Playlist.approved != None,
+    )
+
+
+@bp.route("/")
+def index():
+    djs = get_dj_list()
+    dj_map = {int(dj["id"]): dj["airname"] for dj in djs}
+    dj_map[1] = "Automation"
+
+    playlists = upcoming_playlists_query(datetime.datetime.utcnow()).all()
+
     # localize dates and then group by them
     unplayed = defaultdict(list)
     for (
@@ -87,23 +128,77 @@ def index():
 
 @bp.route("/playlists/export/<int:playlist_id>")
 def export_playlist(playlist_id):
-    playlist = Playlist.query.get_or_404(playlist_id)
-    tracks = playlist.tracks.order_by(QueuedTrack.id)
+    if db.session.query(Playlist.id).filter(Playlist.id == playlist_id).first() is None:
+        abort(404)
 
-    playlist_text = ""
-    for track in tracks.all():
-        playlist_text += "{0}\n".format(track.url)
+    extinf = request.args.get("extinf") == "1"
 
-    return (
-        playlist_text,
-        200,
-        {
+    # automation scripts download the same playlists over and over
+    etag = playlist_etag(playlist_id, extinf)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    response = Response(
+        stream_with_context(generate_m3u8(playlist_id, extinf)),
+        headers={
             "Content-Disposition": 'attachment; filename="playlist_{0}.m3u8"'.format(
                 int(playlist_id)
             ),
             "Content-Type": "application/vnd.apple.mpegurl; charset=utf-8",
         },
     )
+    response.set_etag(etag)
+    return response
+
+
+@bp.route("/playlists/export")
+def export_playlists():
+    """Export every playlist starting within a range of dates, inclusive, as
+    a zip archive of M3U8 files."""
+    slot_tz = get_slot_tz()
+    try:
+        start = datetime.datetime.strptime(request.args["start"], "%Y-%m-%d")
+        end = datetime.datetime.strptime(request.args["end"], "%Y-%m-%d")
+    except (KeyError, ValueError):
+        abort(400)
+
+    start = to_naive_utc(start.replace(tzinfo=slot_tz))
+    end = to_naive_utc((end + datetime.timedelta(days=1)).replace(tzinfo=slot_tz))
+    extinf = request.args.get("extinf") == "1"
+
+    playlists = (
+        db.session.query(Playlist.id, Playlist.timeslot_start)
+        .filter(
+            Playlist.approved != None,
+            Playlist.timeslot_start >= start,
+            Playlist.timeslot_start < end,
+        )
+        .order_by(Playlist.timeslot_start, Playlist.id)
+        .all()
+    )
+
+    files = (
+        (
+            "{0}_playlist_{1:d}.m3u8".format(
+                localize_datetime(timeslot_start).strftime("%Y%m%d-%H%M"),
+                playlist_id,
+            ),
+            generate_m3u8(playlist_id, extinf),
+        )
+        for playlist_id, timeslot_start in playlists
+    )
+
+    return Response(
+        stream_with_context(generate_zip(files)),
+        headers={
+            "Content-Disposition": 'attachment; filename="playlists_{0}_{1}.zip"'.format(
+                request.args["start"], request.args["end"]
+            ),
+            "Content-Type": "application/zip",
+        },
+    )
 
 
 @bp.route("/playlists/edit/<int:playlist_id>", methods=["GET", "POST"])
@@ -114,10 +209,7 @@ def edit_playlist(playlist_id):
         if request.headers.get("X-Requested-With") is None:
             abort(400)
 
-        existing_tracks = QueuedTrack.query.filter(
-            QueuedTrack.playlist_id == playlist_id,
-        )
-        if existing_tracks.filter(QueuedTrack.played == True).count() > 0:
+        if playlist.started:
             return jsonify(
                 {
                     "success": False,
@@ -126,42 +218,90 @@ def edit_playlist(playlist_id):
                 }
             )
 
-        for track in existing_tracks.all():
-            db.session.delete(track)
+        urls = request.form.getlist("tracks[]")
+
+        # tracks already in the playlist were validated when they were added,
+        # so they are kept as they are, just moved if need be
+        stored = defaultdict(deque)
+        positions = {}
+        for track_id, url, position in (
+            db.session.query(QueuedTrack.id, QueuedTrack.url, QueuedTrack.position)
+            .filter(QueuedTrack.playlist_id == playlist.id)
+            .order_by(QueuedTrack.position)
+        ):
+            stored[url].append(track_id)
+            positions[track_id] = position
+
+        kept = {}
+        for index, url in enumerate(urls):
+            if len(stored[url]) > 0:
+                kept[index] = stored[url].popleft()
+
+        new_indexes = [index for index in range(len(urls)) if index not in kept]
+        processed_urls = dict(
+            zip(
+                new_indexes,
+                map_by_host(try_process_url, [urls[index] for index in new_indexes]),
+            )
+        )
 
-        index = 0
         ok = True
         results = []
+        moved = []
+        added = []
 
-        for url in request.form.getlist("tracks[]"):
-            index += 1
-
-            try:
-                url = process_url(url)
-            except PlaylistValidationException:
+        for index, url in enumerate(urls):
+            if index in kept:
+                results.append(
+                    {
+                        "index": index + 1,
+                        "url": url,
+                        "status": "OK",
+                    }
+                )
+                if positions[kept[index]] != index:
+                    moved.append((kept[index], index))
+            elif processed_urls[index] is None:
                 ok = False
                 results.append(
                     {
-                        "index": index,
+                        "index": index + 1,
                         "url": url,
                         "status": "Error",
                     }
                 )
-                continue
             else:
                 results.append(
                     {
-                        "index": index,
-                        "url": url,
+                        "index": index + 1,
+                        "url": processed_urls[index],
                         "status": "OK",
                     }
                 )
-
-            track = QueuedTrack(url, playlist.id)
-            db.session.add(track)
+                added.append((processed_urls[index], index))
 
         if ok:
+            # the row lock keeps pollers out until the new positions are in
+            # place; one may have claimed a track since the check above
+            cursor = db.session.execute(
+                db.select(Playlist.cursor)
+                .where(Playlist.id == playlist.id)
+                .with_for_update()
+            ).scalar()
+            if cursor > 0:
+                db.session.rollback()
+                return jsonify(
+                    {
+                        "success": False,
+                        "results": [],
+                        "message": "One or more tracks have already been played.",
+                    }
+                )
+
+            removed = [track_id for ids in stored.values() for track_id in ids]
+            update_tracks(playlist.id, moved, removed, added)
             db.session.commit()
+            schedule.notify()
             return jsonify(
                 {
                     "success": True,
@@ -177,21 +317,28 @@ def edit_playlist(playlist_id):
                 }
             )
 
-    tracks = playlist.tracks.order_by(QueuedTrack.id)
+    tracks = playlist.tracks.order_by(QueuedTrack.position)
 
     # Make sure no tracks in the playlist have been played yet
-    for track in tracks.all():
-        if track.played:
-            return render_template(
-                "playlist_being_played.html",
-                playlist=playlist,
-                tracks=[t.serialize() for t in tracks.all()],
-            )
+    if playlist.started:
+        return render_template(
+            "playlist_being_played.html",
+            playlist=playlist,
+            tracks=[t.serialize() for t in tracks.all()],
+        )
+
+    # fill in whatever metadata is cached now, without waiting on the file
+    # servers; the editor requests the rest once the page has loaded
+    tracks = [t.serialize() for t in tracks.all()]
+    metadata = get_cached_tracks_metadata([t["url"] for t in tracks])
+    for track, track_metadata in zip(tracks, metadata):
+        if track_metadata is not None:
+            track["metadata"] = track_metadata
 
     return render_template(
         "edit_playlist.html",
         playlist=playlist,
-        tracks=[t.serialize() for t in tracks.all()],
+        tracks=tracks,
     )
 
 
@@ -200,20 +347,20 @@ def delete_playlist(playlist_id):
     playlist = Playlist.query.get_or_404(playlist_id)
 
     # Make sure no tracks in the playlist have been played yet
-    for track in playlist.tracks.all():
-        if track.played:
-            return jsonify(
-                {
-                    "success": False,
-                    "message": "One or more tracks in the playlist have already been played.",
-                }
-            )
+    if playlist.started:
+        return jsonify(
+            {
+                "success": False,
+                "message": "One or more tracks in the playlist have already been played.",
+            }
+        )
 
     # No tracks have been played, so mark the playlist as not approved
     # We do this instead of deleting to enable restoration of deleted playlists
     # if necessary
     playlist.approved = None
     db.session.commit()
+    schedule.remove(playlist.id)
     return jsonify(
         {
             "success": True,
@@ -261,34 +408,8 @@ def create_playlist():
         else:
             queue = form.queue.data
 
-        existing_playlists = Playlist.query.filter(
-            db.or_(
-                # The new playlist is either exactly at the same time as an
-                # existing playlist or there's an existing playlist entirely
-                # inside the same time slot
-                db.and_(
-                    # An existing playlist starts after (inclusive) we do
-                    Playlist.timeslot_start >= timeslot_start,
-                    # AND that playlist ends before (inclusive) we do
-                    Playlist.timeslot_end <= timeslot_end,
-                ),
-                # The new playlist will start before an existing playlist ends
-                db.and_(
-                    # An existing playlist starts before (inclusive) we do
-                    Playlist.timeslot_start <= timeslot_start,
-                    # AND that playlist ends after we start
-                    Playlist.timeslot_end > timeslot_start,
-                ),
-                # The new playlist will end after an existing playlist starts
-                db.and_(
-                    # An existing playlist starts after (inclusive) we do
-                    Playlist.timeslot_start >= timeslot_start,
-                    # AND that playlist starts before we end
-                    Playlist.timeslot_start < timeslot_end,
-                ),
-            ),
-            Playlist.queue == queue,
-            Playlist.approved != None,
+        existing_playlists = overlapping_playlists_query(
+            timeslot_start, timeslot_end, queue
         )
 
         # check for existing playlists in the same slot
@@ -306,6 +427,7 @@ You'll need to either delete the existing playlist or pick a different slot."""
             db.session.add(playlist)
 
             db.session.commit()
+            schedule.update(playlist)
 
             return render_template(
                 "edit_playlist.html",
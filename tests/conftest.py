@@ -0,0 +1,81 @@
+import base64
+import datetime
+import json
+import os
+import pytest
+import tempfile
+
+
+# pload.app creates the app when it is imported, so it has to be configured
+# before then; set TEST_DATABASE_URL to run against PostgreSQL
+config_dir = tempfile.mkdtemp()
+config_path = os.path.join(config_dir, "config.json")
+with open(config_path, "w") as f:
+    json.dump(
+        {
+            "SECRET_KEY": "test",
+            "BASIC_AUTH_USERNAME": "test",
+            "BASIC_AUTH_PASSWORD": "test",
+            "SQLALCHEMY_DATABASE_URI": os.environ.get(
+                "TEST_DATABASE_URL",
+                "sqlite:///{0}".format(os.path.join(config_dir, "pload.sqlite")),
+            ),
+            "ELASTICSEARCH_HOSTS": ["http://127.0.0.1:1/"],
+            "TRACK_VALIDATE_CHECK_EXISTS": False,
+            "WTF_CSRF_ENABLED": False,
+        },
+        f,
+    )
+os.environ["APP_CONFIG_PATH"] = config_path
+
+
+@pytest.fixture
+def app():
+    from pload.app import app
+    from pload.db import db
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers():
+    credentials = base64.b64encode(b"test:test").decode("utf-8")
+    return {"Authorization": "Basic {0}".format(credentials)}
+
+
+@pytest.fixture
+def make_playlist(app):
+    """Create an approved playlist with the given track URLs, in order, that
+    started an hour ago, and return its ID."""
+    from pload.db import db
+    from pload.models import Playlist, QueuedTrack
+
+    def make_playlist(urls, queue=None, start=None):
+        if start is None:
+            start = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
+
+        with app.app_context():
+            playlist = Playlist(start, start + datetime.timedelta(hours=2), 1, queue)
+            playlist.approved = datetime.datetime.utcnow()
+            db.session.add(playlist)
+            db.session.flush()
+
+            for position, url in enumerate(urls):
+                db.session.add(QueuedTrack(url, playlist.id, position))
+
+            db.session.commit()
+            return playlist.id
+
+    return make_playlist
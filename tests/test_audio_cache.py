@@ -0,0 +1,122 @@
+import os
+import pytest
+from pload.api import playback_url
+from pload.audio_cache import AudioCache, audio_cache
+from pload.exceptions import AudioCacheFullException
+
+
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = AudioCache()
+    cache.directory = str(tmp_path)
+    cache.max_size = 30
+    return cache
+
+
+def add_file(cache, name, size, mtime):
+    key = cache.key_for("http://example.com/{0}.mp3".format(name))
+    path = cache.path_for(key)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return key
+
+
+def test_evict_skips_pinned_files(cache):
+    oldest = add_file(cache, "a", 10, 1000)
+    older = add_file(cache, "b", 10, 2000)
+    newest = add_file(cache, "c", 10, 3000)
+    cache.max_size = 20
+
+    assert cache.evict({oldest})
+
+    assert os.path.exists(cache.path_for(oldest))
+    assert not os.path.exists(cache.path_for(older))
+    assert os.path.exists(cache.path_for(newest))
+
+
+def test_evict_reports_when_pinned_files_do_not_fit(cache):
+    first = add_file(cache, "a", 20, 1000)
+    second = add_file(cache, "b", 20, 2000)
+
+    assert not cache.evict({first, second})
+
+    assert os.path.exists(cache.path_for(first))
+    assert os.path.exists(cache.path_for(second))
+
+
+def test_fetch_does_not_push_out_upcoming_tracks(cache, monkeypatch):
+    upcoming = add_file(cache, "a", 20, 1000)
+    file_url = "http://example.com/b.mp3"
+    monkeypatch.setattr(
+        "pload.audio_cache.http_session.get",
+        lambda url, stream: FakeResponse(b"y" * 20),
+    )
+
+    with pytest.raises(AudioCacheFullException):
+        cache.fetch(file_url, {upcoming, cache.key_for(file_url)})
+
+    assert os.path.exists(cache.path_for(upcoming))
+    assert cache.lookup(file_url) is None
+
+
+def test_cached_tracks_need_a_token(app, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_cache, "directory", str(tmp_path))
+    key = add_file(audio_cache, "a", 10, 1000)
+    other_key = add_file(audio_cache, "b", 10, 1000)
+
+    url = "/api/cached/{0}".format(key)
+    assert client.get(url).status_code == 403
+    assert client.get(url, query_string={"token": "x"}).status_code == 403
+    assert (
+        client.get(
+            url, query_string={"token": audio_cache.token_for(other_key)}
+        ).status_code
+        == 403
+    )
+
+    resp = client.get(url, query_string={"token": audio_cache.token_for(key)})
+    assert resp.status_code == 200
+    assert resp.data == b"x" * 10
+    resp.close()
+
+
+def test_cached_track_tokens_expire(app, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_cache, "directory", str(tmp_path))
+    key = add_file(audio_cache, "a", 10, 1000)
+    token = audio_cache.token_for(key)
+
+    monkeypatch.setattr(audio_cache, "token_ttl", -1)
+    resp = client.get("/api/cached/{0}".format(key), query_string={"token": token})
+    assert resp.status_code == 403
+
+
+def test_playback_url_carries_a_token_not_credentials(
+    app, client, auth_headers, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(audio_cache, "directory", str(tmp_path))
+    key = add_file(audio_cache, "a", 10, 1000)
+
+    with app.test_request_context("/api/next_track", headers=auth_headers):
+        url = playback_url("http://example.com/a.mp3", 1)
+
+    assert url.startswith("http://localhost/api/cached/{0}?token=".format(key))
+    assert "test:test" not in url
+
+    resp = client.get(url)
+    assert resp.status_code == 200
+    resp.close()
@@ -0,0 +1,127 @@
+import pytest
+import sqlalchemy as sa
+import pload.metadata
+import pload.views
+from pload.db import db
+from pload.metadata import metadata_cache
+from pload.models import Playlist, QueuedTrack
+
+
+@pytest.fixture
+def no_lookups(monkeypatch):
+    """Make any lookup beyond the metadata cache fail the test."""
+
+    def lookup(*args, **kwargs):
+        raise AssertionError("looked up metadata outside the cache")
+
+    monkeypatch.setattr(pload.metadata, "search_tracks_metadata", lookup)
+    monkeypatch.setattr(pload.metadata, "read_track_metadata", lookup)
+
+
+def test_editor_renders_with_cached_metadata_only(
+    app, client, make_playlist, no_lookups
+):
+    urls = ["http://example.com/cached.mp3", "http://example.com/missing.mp3"]
+    playlist_id = make_playlist(urls)
+    with app.app_context():
+        metadata_cache.store(urls[0], {"artist": "Cached Artist", "length": 61})
+
+    response = client.get("/playlists/edit/{0}".format(playlist_id))
+    assert response.status_code == 200
+    assert b"Cached Artist" in response.data
+
+
+def test_playlist_metadata(app, client, make_playlist, monkeypatch):
+    monkeypatch.setattr(
+        pload.metadata,
+        "search_tracks_metadata",
+        lambda urls: {url: {"title": url.rsplit("/", 1)[-1]} for url in urls},
+    )
+    playlist_id = make_playlist(["http://example.com/a.mp3"])
+    other_id = make_playlist(["http://example.com/b.mp3"])
+    ((track_id, _),) = stored_tracks(app, playlist_id)
+    ((other_track_id, _),) = stored_tracks(app, other_id)
+    url = "/api/playlists/{0}/metadata".format(playlist_id)
+    headers = {"X-Requested-With": "XMLHttpRequest"}
+
+    # tracks from other playlists are not looked up
+    response = client.post(
+        url, data={"ids[]": [track_id, other_track_id]}, headers=headers
+    )
+    assert response.get_json()["tracks"] == [{"track_id": track_id, "title": "a.mp3"}]
+
+    response = client.post(url, data={"ids[]": ["annotate:x"]}, headers=headers)
+    assert response.status_code == 400
+    assert client.post(url, data={"ids[]": [track_id]}).status_code == 400
+
+
+def stored_tracks(app, playlist_id):
+    with app.app_context():
+        return [
+            (track.id, track.url)
+            for track in QueuedTrack.query.filter_by(playlist_id=playlist_id).order_by(
+                QueuedTrack.position
+            )
+        ]
+
+
+def save(client, playlist_id, urls):
+    return client.post(
+        "/playlists/edit/{0}".format(playlist_id),
+        data={"tracks[]": urls},
+        headers={"X-Requested-With": "XMLHttpRequest"},
+    ).get_json()
+
+
+@pytest.fixture
+def validated(monkeypatch):
+    """Record the URLs that get validated, accepting all of them."""
+    urls = []
+
+    def try_process_url(url):
+        urls.append(url)
+        return url
+
+    monkeypatch.setattr(pload.views, "try_process_url", try_process_url)
+    return urls
+
+
+def test_save_only_validates_new_tracks(app, client, make_playlist, validated):
+    a, b, c, d = ["http://example.com/{0}.mp3".format(x) for x in "abcd"]
+    playlist_id = make_playlist([a, b, a, c])
+    before = stored_tracks(app, playlist_id)
+
+    assert save(client, playlist_id, [c, a, d, a]) == {"success": True}
+
+    after = stored_tracks(app, playlist_id)
+    assert [url for _, url in after] == [c, a, d, a]
+    # kept rows keep their IDs, duplicates matched up in order
+    assert after[0][0] == before[3][0]
+    assert after[1][0] == before[0][0]
+    assert after[3][0] == before[2][0]
+    assert after[2][0] not in [track_id for track_id, _ in before]
+    assert validated == [d]
+
+
+def test_save_fails_if_a_track_is_claimed_meanwhile(
+    app, client, make_playlist, monkeypatch
+):
+    a, b = "http://example.com/a.mp3", "http://example.com/b.mp3"
+    playlist_id = make_playlist([a, b])
+    before = stored_tracks(app, playlist_id)
+
+    def try_process_url(url):
+        # a poller claims the first track while the new one is validated
+        with db.engine.begin() as conn:
+            conn.execute(
+                sa.update(Playlist.__table__)
+                .where(Playlist.__table__.c.id == playlist_id)
+                .values(cursor=1)
+            )
+        return url
+
+    monkeypatch.setattr(pload.views, "try_process_url", try_process_url)
+
+    data = save(client, playlist_id, [b, a, "http://example.com/c.mp3"])
+    assert data["success"] is False
+    assert stored_tracks(app, playlist_id) == before
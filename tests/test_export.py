@@ -0,0 +1,97 @@
+import datetime
+import io
+import zipfile
+from pload.db import db
+from pload.metadata import metadata_cache
+from pload.models import Playlist, QueuedTrack
+from pload.track_queue import update_tracks
+
+
+urls = ["http://example.com/{0}.mp3".format(i) for i in range(1, 4)]
+
+
+def test_etag_matches_until_changed(client, make_playlist):
+    playlist_id = make_playlist(urls)
+
+    response = client.get("/playlists/export/{0}".format(playlist_id))
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    response = client.get(
+        "/playlists/export/{0}".format(playlist_id),
+        headers={"If-None-Match": etag},
+    )
+    assert response.status_code == 304
+
+
+def reorder(app, playlist_id, order):
+    """Put the tracks of a playlist in the given order of their original
+    positions."""
+    with app.app_context():
+        tracks = (
+            QueuedTrack.query.filter_by(playlist_id=playlist_id)
+            .order_by(QueuedTrack.id)
+            .all()
+        )
+        moved = [(tracks[i].id, position) for position, i in enumerate(order)]
+        update_tracks(playlist_id, moved, [], [])
+        db.session.commit()
+
+
+def test_reorder_changes_etag(app, client, make_playlist):
+    playlist_id = make_playlist(urls)
+
+    # these two orders have the same count, highest ID and sum of
+    # ID * (position + 1), which the ETag used to be made from
+    reorder(app, playlist_id, [0, 2, 1])
+    response = client.get("/playlists/export/{0}".format(playlist_id))
+    etag = response.headers["ETag"]
+    assert response.get_data(as_text=True).split() == [urls[0], urls[2], urls[1]]
+
+    reorder(app, playlist_id, [1, 0, 2])
+    response = client.get(
+        "/playlists/export/{0}".format(playlist_id),
+        headers={"If-None-Match": etag},
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.get_data(as_text=True).split() == [urls[1], urls[0], urls[2]]
+
+
+def test_extinf_etag_changes_once_metadata_is_cached(app, client, make_playlist):
+    playlist_id = make_playlist(urls)
+    url = "/playlists/export/{0}".format(playlist_id)
+
+    response = client.get(url, query_string={"extinf": "1"})
+    extinf_etag = response.headers["ETag"]
+    assert "#EXTINF" not in response.get_data(as_text=True)
+    plain_etag = client.get(url).headers["ETag"]
+
+    with app.app_context():
+        metadata_cache.store(urls[0], {"artist": "Artist", "title": "Title"})
+
+    response = client.get(
+        url, query_string={"extinf": "1"}, headers={"If-None-Match": extinf_etag}
+    )
+    assert response.status_code == 200
+    assert "#EXTINF:-1,Artist - Title" in response.get_data(as_text=True)
+
+    # the plain export does not change with metadata
+    response = client.get(url, headers={"If-None-Match": plain_etag})
+    assert response.status_code == 304
+
+
+def test_zip_export_leaves_out_unapproved_playlists(app, client, make_playlist):
+    start = datetime.datetime(2020, 6, 1, 16, 0)
+    approved_id = make_playlist(urls, start=start)
+    deleted_id = make_playlist(urls, start=start)
+    with app.app_context():
+        db.session.get(Playlist, deleted_id).approved = None
+        db.session.commit()
+
+    response = client.get("/playlists/export?start=2020-06-01&end=2020-06-01")
+    assert response.status_code == 200
+
+    names = zipfile.ZipFile(io.BytesIO(response.get_data())).namelist()
+    assert len(names) == 1
+    assert names[0].endswith("_playlist_{0:d}.m3u8".format(approved_id))
@@ -0,0 +1,40 @@
+import requests
+import threading
+from pload.http_session import http_session
+
+
+def test_each_thread_gets_its_own_session_on_one_pool(app):
+    sessions = []
+
+    def run():
+        sessions.append(http_session.session)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, sessions))) == 4
+    for session in sessions:
+        assert session.get_adapter("http://example.com/") is http_session.adapter
+        assert session.get_adapter("https://example.com/") is http_session.adapter
+
+    assert http_session.session is http_session.session
+
+
+def test_requests_get_default_timeouts(app, monkeypatch):
+    calls = []
+
+    def request(self, method, url, **kwargs):
+        calls.append((method, kwargs))
+
+    monkeypatch.setattr(requests.Session, "request", request)
+
+    http_session.get("http://example.com/")
+    http_session.head("http://example.com/", timeout=1)
+
+    assert calls == [
+        ("GET", {"timeout": http_session.timeout}),
+        ("HEAD", {"timeout": 1, "allow_redirects": False}),
+    ]
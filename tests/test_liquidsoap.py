@@ -0,0 +1,135 @@
+import pytest
+import random
+import time
+from pload.liquidsoap import LiquidsoapURI
+
+
+alphabet = 'ab:,="\\ x1'
+
+
+def random_string(rng, max_length):
+    return "".join(rng.choice(alphabet) for _ in range(rng.randint(0, max_length)))
+
+
+def assert_round_trips(uri):
+    parsed = LiquidsoapURI.parse(str(uri))
+    assert parsed.url == uri.url
+    assert parsed.protocols == uri.protocols
+
+
+def test_parse():
+    uri = LiquidsoapURI.parse(
+        'annotate:title="a:b, \\"c\\"",trackman_dj_id=5:ffmpeg:replay_gain:'
+        "http://example.com/a.mp3"
+    )
+    assert uri.url == "http://example.com/a.mp3"
+    assert uri.protocols == [
+        ("annotate", {"title": 'a:b, "c"', "trackman_dj_id": "5"}),
+        ("ffmpeg", None),
+        ("replay_gain", None),
+    ]
+
+
+@pytest.mark.parametrize(
+    "uri",
+    [
+        'annotate:title="unbalanced:http://example.com/a.mp3',
+        'annotate:title="a"b":http://example.com/a.mp3',
+        "annotate:title:http://example.com/a.mp3",
+        "annotate:=a:http://example.com/a.mp3",
+        "annotate:title=a",
+        'annotate:title="a\\":http://example.com/a.mp3',
+    ],
+)
+def test_malformed_annotations_are_rejected(uri):
+    with pytest.raises(ValueError):
+        LiquidsoapURI.parse(uri)
+
+
+def test_equals_in_values():
+    uri = LiquidsoapURI.parse(
+        'annotate:title="a=b",query="x=1&y=2":http://example.com/a.mp3?c=d'
+    )
+    assert uri.annotations == {"title": "a=b", "query": "x=1&y=2"}
+    assert uri.url == "http://example.com/a.mp3?c=d"
+    assert_round_trips(uri)
+
+
+def test_fuzz_round_trip_random_strings():
+    """Whatever the parser accepts, it must serialize to something that
+    parses back to the same thing."""
+    rng = random.Random(16)
+    for _ in range(20000):
+        prefix = rng.choice(["", "annotate:", "ffmpeg:annotate:"])
+        try:
+            uri = LiquidsoapURI.parse(prefix + random_string(rng, 20))
+        except ValueError:
+            continue
+        assert_round_trips(uri)
+
+
+def test_fuzz_round_trip_built_uris():
+    rng = random.Random(17)
+    for _ in range(5000):
+        protocols = []
+        for _ in range(rng.randint(0, 3)):
+            if rng.random() < 0.5:
+                annotations = {
+                    "k{0}".format(i): random_string(rng, 8)
+                    for i in range(rng.randint(1, 3))
+                }
+                protocols.append(("annotate", annotations))
+            else:
+                protocols.append((rng.choice(["ffmpeg", "replay_gain"]), None))
+
+        uri = LiquidsoapURI("http://example.com/" + random_string(rng, 5), protocols)
+        assert_round_trips(uri)
+
+
+def test_annotate_adds_to_outermost_protocol():
+    uri = LiquidsoapURI.parse("replay_gain:http://example.com/a.mp3")
+    uri.annotate("trackman_dj_id", "5")
+    assert str(uri) == "annotate:trackman_dj_id=5:replay_gain:http://example.com/a.mp3"
+
+    uri.annotate("title", 'a "b"')
+    assert_round_trips(uri)
+
+
+def parse_time(uri):
+    start = time.perf_counter()
+    try:
+        LiquidsoapURI.parse(uri)
+    except ValueError:
+        pass
+    return time.perf_counter() - start
+
+
+@pytest.mark.parametrize(
+    "make_uri",
+    [
+        # colons inside a quoted value, which the old splitting regex
+        # rescanned the rest of the string for at every one
+        lambda n: 'annotate:title="{0}":http://example.com/a.mp3'.format("a:" * n),
+        # many annotations with quotes, escapes and separators in them
+        lambda n: "annotate:{0}:http://example.com/a.mp3".format(
+            ",".join('k{0}="v:a,l\\"ue"'.format(i) for i in range(n // 8))
+        ),
+        # a long chain of annotate protocols
+        lambda n: "{0}http://example.com/a.mp3".format("annotate:a=1:" * (n // 6)),
+        # an unterminated quote, which has to be rejected just as quickly
+        lambda n: 'annotate:title="{0}:http://example.com/a.mp3'.format("a:" * n),
+    ],
+)
+def test_long_annotations_parse_in_linear_time(make_uri):
+    """Benchmark parsing 100KB and 400KB URIs; run with -s to see the times.
+    The old splitting regex took about 8 seconds on the first of these at
+    50KB, and each takes milliseconds now."""
+    times = []
+    for n in (50000, 200000):
+        uri = make_uri(n)
+        times.append(min(parse_time(uri) for _ in range(5)))
+        print("{0:d} bytes: {1:.4f}s".format(len(uri), times[-1]))
+
+    assert times[0] < 0.5
+    # four times the length; quadratic time would be sixteen times as long
+    assert times[1] < max(times[0] * 10, 0.05)
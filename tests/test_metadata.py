@@ -0,0 +1,69 @@
+from pload.es import es
+from pload.metadata import get_tracks_metadata, metadata_cache
+from pload.song_import import song_id
+
+
+def test_index_and_cache_give_the_same_fields(app, monkeypatch):
+    url = "http://example.com/a.mp3"
+
+    def mget(index, body, **kwargs):
+        assert body["ids"] == [song_id(url)]
+        return {
+            "docs": [
+                {
+                    "found": True,
+                    "_source": {
+                        "url": url,
+                        "artist": "Artist",
+                        "title": "Title",
+                        "length": "215",
+                        "content_hash": "abc",
+                        "suggest": {"input": ["Artist"]},
+                    },
+                }
+            ]
+        }
+
+    monkeypatch.setattr(es, "mget", mget)
+
+    with app.app_context():
+        misses = metadata_cache.misses
+        from_index = get_tracks_metadata([url])
+        assert metadata_cache.misses == misses + 1
+
+        hits = metadata_cache.hits
+        from_cache = get_tracks_metadata([url])
+        assert metadata_cache.hits == hits + 1
+
+    assert from_index == from_cache
+    assert from_index == [{"artist": "Artist", "title": "Title", "length": 215}]
+
+
+def test_evicts_every_so_often_rather_than_on_every_insert(app, monkeypatch):
+    monkeypatch.setattr(metadata_cache, "max_size", 2)
+    monkeypatch.setattr(metadata_cache, "evict_interval", 3)
+    monkeypatch.setattr(metadata_cache, "inserts", 0)
+
+    evictions = []
+    evict = metadata_cache.evict
+
+    def counting_evict(conn):
+        evictions.append(True)
+        evict(conn)
+
+    monkeypatch.setattr(metadata_cache, "evict", counting_evict)
+
+    with app.app_context():
+        for i in range(3):
+            metadata_cache.store(
+                "http://example.com/{0}.mp3".format(i), {"title": str(i)}
+            )
+        assert len(evictions) == 1
+        assert metadata_cache.stats()["size"] == 2
+
+        for i in range(3, 5):
+            metadata_cache.store(
+                "http://example.com/{0}.mp3".format(i), {"title": str(i)}
+            )
+        assert len(evictions) == 1
+        assert metadata_cache.stats()["size"] == 4
@@ -0,0 +1,103 @@
+"""The queries that run on every poll and page load must keep using an index
+as tables grow, so none of them may need a full table scan."""
+import datetime
+import pytest
+import sqlalchemy as sa
+from pload.db import db
+from pload.schedule import schedule_query
+from pload.track_queue import expired_lease, queued_track
+from pload.views import overlapping_playlists_query, upcoming_playlists_query
+
+
+def hot_queries():
+    """The queries run on every poll or page load, with representative
+    parameters."""
+    now = datetime.datetime.utcnow()
+    later = now + datetime.timedelta(hours=2)
+
+    return [
+        ("schedule index", schedule_query(now).statement),
+        ("scheduled playlists", upcoming_playlists_query(now).statement),
+        (
+            "overlapping playlists",
+            overlapping_playlists_query(now, later, "default").statement,
+        ),
+        (
+            "expired leases",
+            sa.select(queued_track.c.id)
+            .where(expired_lease(1, now))
+            .order_by(queued_track.c.position)
+            .limit(1),
+        ),
+        (
+            "track at cursor",
+            sa.select(queued_track.c.url).where(
+                queued_track.c.playlist_id == 1,
+                queued_track.c.position == 0,
+            ),
+        ),
+        (
+            "track count",
+            sa.select(sa.func.count(queued_track.c.id)).where(
+                queued_track.c.playlist_id == 1
+            ),
+        ),
+    ]
+
+
+def find_postgresql_seq_scans(plan):
+    scans = []
+    if plan["Node Type"] == "Seq Scan":
+        scans.append(plan["Relation Name"])
+    for subplan in plan.get("Plans", []):
+        scans.extend(find_postgresql_seq_scans(subplan))
+    return scans
+
+
+def explain_seq_scans(conn, statement):
+    """Return the tables that a statement reads with a full table scan.
+    Skips the test on databases whose plans we cannot read."""
+    compiled = statement.compile(dialect=conn.dialect)
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    if conn.dialect.name == "postgresql":
+        # tables are usually tiny on a development database, so make sure the
+        # planner only picks a sequential scan when there is no usable index
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+        plan = conn.exec_driver_sql(
+            "EXPLAIN (FORMAT JSON) {0}".format(compiled), params
+        ).scalar()
+        return find_postgresql_seq_scans(plan[0]["Plan"])
+    elif conn.dialect.name == "sqlite":
+        rows = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN {0}".format(compiled), params
+        ).all()
+        return [
+            detail[5:]
+            for _, _, _, detail in rows
+            if detail.startswith("SCAN ")
+            and "INDEX" not in detail
+            and detail != "SCAN CONSTANT ROW"
+        ]
+    else:
+        pytest.skip("Query plans cannot be checked on {0}".format(conn.dialect.name))
+
+
+def test_hot_queries_use_an_index(app):
+    failures = []
+
+    with app.app_context(), db.engine.connect() as conn:
+        for name, statement in hot_queries():
+            trans = conn.begin()
+            try:
+                scans = explain_seq_scans(conn, statement)
+            finally:
+                trans.rollback()
+
+            if len(scans) > 0:
+                failures.append("{0} scans {1}".format(name, ", ".join(scans)))
+
+    assert failures == []
@@ -0,0 +1,159 @@
+import pytest
+import random
+import re
+import time
+import warnings
+from types import SimpleNamespace
+from pload import defaults
+from pload.rewrite import literal_prefix, RewriteEngine
+
+
+def make_engine(rules, cache_size=16):
+    app = SimpleNamespace(
+        config={"REWRITES": rules, "TRACK_URL_REWRITE_CACHE_SIZE": cache_size}
+    )
+    return RewriteEngine("REWRITES", app)
+
+
+def rewrite_one_at_a_time(rules, url):
+    for pattern, replacement in rules:
+        url = re.sub(pattern, replacement, url)
+    return url
+
+
+@pytest.mark.parametrize(
+    "pattern,prefix",
+    [
+        (r"^http:\/\/titanic\.wuvt\.vt\.edu", "http://titanic.wuvt.vt.edu"),
+        (r"^https?://a", "http"),
+        (r"^ab*c", "a"),
+        (r"^a{2}", ""),
+        (r"^a\d", "a"),
+        (r"^(a|b)", None),
+        (r"^a|b", None),
+        (r"a", None),
+        ("^", ""),
+        ("^\\", ""),
+    ],
+)
+def test_literal_prefix(pattern, prefix):
+    assert literal_prefix(pattern) == prefix
+
+
+def test_fuzz_literal_prefix():
+    """Every string a random pattern matches must start with its prefix."""
+    rng = random.Random(16)
+    pattern_chars = "ab.:/\\^$*+?{}[]|()12-"
+    checked = 0
+
+    for _ in range(5000):
+        pattern = "^" + "".join(
+            rng.choice(pattern_chars) for _ in range(rng.randint(0, 8))
+        )
+        try:
+            # random runs of [ and - look like future set syntax to re
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", FutureWarning)
+                compiled = re.compile(pattern)
+        except re.error:
+            continue
+        prefix = literal_prefix(pattern)
+
+        for _ in range(20):
+            url = "".join(rng.choice("ab.:/12") for _ in range(rng.randint(0, 8)))
+            if compiled.match(url) is not None:
+                checked += 1
+                assert prefix is None or url.startswith(prefix), (pattern, url)
+
+    assert checked > 0
+
+
+def test_configured_rules_match_one_at_a_time():
+    for config_key in ("TRACK_URL_REWRITES", "TRACK_URL_DISPLAY_REWRITES"):
+        rules = getattr(defaults, config_key)
+        engine = make_engine(rules)
+
+        urls = ["https://example.com/music/a.mp3"]
+        for pattern, _ in rules:
+            host = pattern.lstrip("^").replace("\\", "")
+            urls.append("{0}/music/a.mp3".format(host))
+            urls.append("{0}.evil.example.com/a.mp3".format(host))
+
+        for url in urls:
+            # twice, so the second one comes from the cache
+            assert engine.rewrite(url) == rewrite_one_at_a_time(rules, url)
+            assert engine.rewrite(url) == rewrite_one_at_a_time(rules, url)
+
+
+def test_fuzz_random_rules_match_one_at_a_time():
+    """Skipping rules by their prefix must never change the result, even
+    when an earlier rule rewrites a URL into one a later rule matches."""
+    rng = random.Random(17)
+    pieces = ["a", "b", ":", "/", "http", "s", r"\.", ".", "x*", "b?", r"\d"]
+
+    for _ in range(500):
+        rules = []
+        for _ in range(rng.randint(1, 4)):
+            pattern = "".join(rng.choice(pieces) for _ in range(rng.randint(0, 4)))
+            if rng.random() < 0.8:
+                pattern = "^" + pattern
+            replacement = "".join(rng.choice("ab:/1") for _ in range(3))
+            rules.append((pattern, replacement))
+        engine = make_engine(rules)
+
+        for _ in range(20):
+            url = "".join(
+                rng.choice(["a", "b", ":", "/", "http", "s", ".", "1"])
+                for _ in range(rng.randint(0, 6))
+            )
+            assert engine.rewrite(url) == rewrite_one_at_a_time(rules, url), (
+                rules,
+                url,
+            )
+
+
+def rewrite_time(func, urls):
+    start = time.perf_counter()
+    for url in urls:
+        func(url)
+    return time.perf_counter() - start
+
+
+@pytest.mark.parametrize(
+    "config_key", ["TRACK_URL_REWRITES", "TRACK_URL_DISPLAY_REWRITES"]
+)
+def test_engine_is_faster_than_applying_each_rule(config_key):
+    """Benchmark the cost per URL of rewriting with the engine, with and
+    without its cache, against compiling and applying each rule in turn; run
+    with -s to see the times."""
+    rules = getattr(defaults, config_key)
+    count = 20000
+
+    # one URL per rule plus one that no rule matches, cycled through, each
+    # of them distinct so that the first pass never hits the cache
+    hosts = [pattern.lstrip("^").replace("\\", "") for pattern, _ in rules]
+    hosts.append("https://example.com")
+    urls = [
+        "{0}/music/{1:d}/track.mp3".format(hosts[i % len(hosts)], i)
+        for i in range(count)
+    ]
+
+    engines = [make_engine(rules, cache_size=count) for _ in range(3)]
+    times = {
+        "loop": min(
+            rewrite_time(lambda url: rewrite_one_at_a_time(rules, url), urls)
+            for _ in range(3)
+        ),
+        # each engine's first pass, while its cache is empty
+        "engine": min(rewrite_time(engine.rewrite, urls) for engine in engines),
+        "cached": min(rewrite_time(engine.rewrite, urls) for engine in engines),
+    }
+    for name, seconds in times.items():
+        print(
+            "{0} {1:<8} {2:8.3f} us/URL".format(config_key, name, seconds / count * 1e6)
+        )
+
+    # with so few rules the engine only has a small edge without its cache,
+    # so leave some room for noise there
+    assert times["engine"] < times["loop"] * 1.5
+    assert times["cached"] < times["engine"]
@@ -0,0 +1,143 @@
+import elasticsearch
+import pytest
+from pload.es import es
+from pload.search import (
+    build_search_body,
+    parse_search_args,
+    tiebreak_cache,
+    tiebreak_field,
+)
+from pload.search_cache import search_cache
+
+
+@pytest.fixture
+def es_search(monkeypatch):
+    """Replace es.search with one that records each request body and hands
+    back the hits given to it, or raises them if they are an exception."""
+    calls = []
+    responses = []
+
+    def search(index, body):
+        calls.append(body)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return {"hits": {"total": {"value": len(response)}, "hits": response}}
+
+    monkeypatch.setattr(es, "search", search)
+    field_mapping(monkeypatch, {"url": keyword_mapping("url")})
+    search_cache.memory.clear()
+    return calls, responses
+
+
+def keyword_mapping(name):
+    leaf = name.rsplit(".", 1)[-1]
+    return {"full_name": name, "mapping": {leaf: {"type": "keyword"}}}
+
+
+def field_mapping(monkeypatch, fields):
+    """Have the songs index map the given fields, as returned by a field
+    mapping request."""
+
+    def get_field_mapping(index, **kwargs):
+        return {"songs_20200101000000000000": {"mappings": fields}}
+
+    monkeypatch.setattr(es.indices, "get_field_mapping", get_field_mapping)
+    tiebreak_cache.clear()
+
+
+def hit(i):
+    return {
+        "_id": str(i),
+        "_source": {"artist": "Artist", "title": str(i), "url": "u{0}".format(i)},
+        "sort": [1.0, str(i)],
+    }
+
+
+def test_sort_breaks_ties_on_url():
+    for sort in ("", "artist", "-label"):
+        params = parse_search_args({"q": "x", "sort": sort}, 50, 500)
+        body = build_search_body(params)
+        assert body["sort"][-1] == {"url": "asc"}
+        assert "_id" not in [list(field)[0] for field in body["sort"]]
+
+
+@pytest.mark.parametrize(
+    "fields, expected",
+    [
+        ({"url": keyword_mapping("url")}, "url"),
+        ({"url.keyword": keyword_mapping("url.keyword")}, "url.keyword"),
+        ({}, "_id"),
+    ],
+)
+def test_tiebreak_follows_the_live_mapping(app, monkeypatch, fields, expected):
+    field_mapping(monkeypatch, fields)
+    assert tiebreak_field() == expected
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        elasticsearch.ConnectionError("N/A", "refused", None),
+        elasticsearch.NotFoundError(404, "index_not_found_exception", {}),
+        elasticsearch.RequestError(400, "search_phase_execution_exception", {}),
+    ],
+)
+def test_errors_give_no_results_and_are_not_cached(client, es_search, error):
+    calls, responses = es_search
+    responses.extend([error, [hit(1)]])
+
+    response = client.get("/api/search?q=artist&format=compact")
+    assert response.status_code == 200
+    assert response.get_json()["total"] == 0
+
+    response = client.get("/api/search?q=artist&format=compact")
+    assert response.get_json()["total"] == 1
+    assert len(calls) == 2
+
+
+def test_hits_format_keeps_old_keys(client, es_search):
+    calls, responses = es_search
+    responses.append([hit(1)])
+
+    data = client.get("/api/search?q=artist").get_json()
+    assert data["total"]["value"] == 1
+    assert data["hits"][0]["_source"]["url"] == "u1"
+    assert data["next"] is None
+
+
+def test_compact_format(client, es_search):
+    calls, responses = es_search
+    responses.append([hit(1), hit(2)])
+
+    data = client.get("/api/search?q=artist&format=compact&size=2").get_json()
+    assert data["total"] == 2
+    assert data["tracks"][1][data["fields"].index("url")] == "u2"
+    assert data["next"] == [1.0, "2"]
+    assert calls[0]["_source"] == data["fields"]
+
+
+def test_missing_q_is_rejected(client, es_search):
+    response = client.get("/api/search")
+    assert response.status_code == 400
+    assert response.get_json()["success"] is False
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        elasticsearch.ConnectionError("N/A", "refused", None),
+        elasticsearch.NotFoundError(404, "index_not_found_exception", {}),
+        elasticsearch.RequestError(400, "search_phase_execution_exception", {}),
+        elasticsearch.TransportError(503, "unavailable", {}),
+    ],
+)
+def test_suggest_errors_give_no_suggestions(client, monkeypatch, error):
+    def search(index, body):
+        raise error
+
+    monkeypatch.setattr(es, "search", search)
+
+    response = client.get("/api/suggest?q=art")
+    assert response.status_code == 200
+    assert response.get_json() == {"tracks": []}
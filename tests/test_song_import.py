@@ -0,0 +1,89 @@
+import io
+import json
+import pytest
+import pload.song_import
+from pload.song_import import read_songs, song_actions, sync_index
+
+
+class FakeIndices(object):
+    def refresh(self, index):
+        pass
+
+
+class FakeClient(object):
+    """Just enough of an index for sync_index, with scan and parallel_bulk
+    patched to read and write docs."""
+
+    def __init__(self):
+        self.docs = {}
+        self.writes = []
+        self.indices = FakeIndices()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = FakeClient()
+
+    def scan(client, index, query):
+        for doc_id, doc in list(client.docs.items()):
+            yield {"_id": doc_id, "_source": {"content_hash": doc["content_hash"]}}
+
+    def parallel_bulk(client, actions, index, ignore_status=(), **kwargs):
+        for action in actions:
+            action = dict(action)
+            doc_id = action.pop("_id")
+            if action.pop("_op_type", None) == "delete":
+                client.docs.pop(doc_id, None)
+            else:
+                client.docs[doc_id] = action
+                client.writes.append(doc_id)
+            yield True, {}
+
+    monkeypatch.setattr(pload.song_import, "scan", scan)
+    monkeypatch.setattr(pload.song_import, "parallel_bulk", parallel_bulk)
+    return client
+
+
+def song(i, title="Title"):
+    return {
+        "artist": "Artist",
+        "title": title,
+        "album": "Album",
+        "label": "Label",
+        "url": "http://example.com/{0}.mp3".format(i),
+    }
+
+
+def sync(client, songs):
+    f = io.StringIO("\n".join(json.dumps(s) for s in songs))
+    counts, _ = sync_index(client, "songs", song_actions(read_songs(f)), 1, 500, 1)
+    return counts
+
+
+def test_sync_writes_only_changes(client):
+    counts = sync(client, [song(1), song(2), song(3)])
+    assert counts["added"] == 3
+
+    client.writes.clear()
+    counts = sync(client, [song(1), song(2, title="Changed"), song(4)])
+    assert counts == {
+        "added": 1,
+        "updated": 1,
+        "unchanged": 1,
+        "removed": 1,
+        "duplicates": 0,
+    }
+    assert len(client.writes) == 2
+    assert len(client.docs) == 3
+
+
+def test_sync_counts_duplicate_urls_once(client):
+    counts = sync(client, [song(1), song(1), song(2), song(1, title="Other")])
+    assert counts["added"] == 2
+    assert counts["duplicates"] == 2
+    assert len(client.writes) == 2
+
+    counts = sync(client, [song(1), song(1), song(2)])
+    assert counts["added"] == 0
+    assert counts["unchanged"] == 2
+    assert counts["duplicates"] == 1
@@ -0,0 +1,99 @@
+import datetime
+import sqlalchemy as sa
+import threading
+from pload.db import db
+from pload.models import Playlist
+from pload.schedule import schedule
+from pload.track_queue import claim_next_track, lease_tracks
+
+
+thread_count = 8
+track_count = 200
+
+
+def test_concurrent_claims_hand_out_each_track_once(app, make_playlist):
+    urls = ["http://example.com/{0}.mp3".format(i) for i in range(track_count)]
+    playlist_id = make_playlist(urls)
+
+    claimed = [[] for _ in range(thread_count)]
+    errors = []
+    barrier = threading.Barrier(thread_count)
+
+    def poll(claimed_by_thread):
+        try:
+            with app.app_context():
+                barrier.wait()
+                while True:
+                    url = claim_next_track(playlist_id)
+                    if url is None:
+                        break
+                    claimed_by_thread.append(url)
+                db.session.remove()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=poll, args=(claimed[i],)) for i in range(thread_count)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+
+    all_claimed = [url for urls_by_thread in claimed for url in urls_by_thread]
+    assert len(all_claimed) == len(set(all_claimed)), "track handed out twice"
+    assert sorted(all_claimed) == sorted(urls), "track never handed out"
+
+    # claims from a single poller come out in playlist order
+    for urls_by_thread in claimed:
+        assert urls_by_thread == sorted(urls_by_thread, key=urls.index)
+
+
+def unapprove(app, playlist_id):
+    """Unapprove a playlist the way another worker would, behind the back of
+    this one's schedule index."""
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(
+                sa.update(Playlist.__table__)
+                .where(Playlist.__table__.c.id == playlist_id)
+                .values(approved=None)
+            )
+
+
+def test_claims_check_the_playlist_is_still_on_air(app, make_playlist):
+    unapproved_id = make_playlist(["http://example.com/1.mp3"])
+    unapprove(app, unapproved_id)
+
+    start = datetime.datetime.utcnow() - datetime.timedelta(hours=3)
+    ended_id = make_playlist(["http://example.com/2.mp3"], start=start)
+
+    with app.app_context():
+        for playlist_id in (unapproved_id, ended_id):
+            assert claim_next_track(playlist_id) is None
+            assert lease_tracks(playlist_id, 5, 60)[2] == []
+
+
+def test_stale_schedule_does_not_serve_a_deleted_playlist(
+    app, client, auth_headers, make_playlist
+):
+    playlist_id = make_playlist(
+        ["http://example.com/1.mp3", "http://example.com/2.mp3"], queue="default"
+    )
+    with app.app_context():
+        schedule.reload()
+
+    response = client.get("/api/next_track", headers=auth_headers)
+    assert response.data == b"http://example.com/1.mp3\n"
+
+    unapprove(app, playlist_id)
+
+    # the schedule index still has the playlist until its next refresh
+    with app.app_context():
+        assert schedule.current("default") is not None
+    response = client.get("/api/next_track", headers=auth_headers)
+    assert response.status_code == 404
+    response = client.get("/api/next_tracks?n=1", headers=auth_headers)
+    assert response.status_code == 404
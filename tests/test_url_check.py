@@ -0,0 +1,81 @@
+import pytest
+import requests.exceptions
+from pload.cache import TTLCache
+from pload.url_check import URLChecker
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def checker():
+    checker = URLChecker()
+    checker.cache = TTLCache(100)
+    checker.ttl = 3600
+    checker.negative_ttl = 3600
+    return checker
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    """Hand out the given responses to HEAD requests in turn, raising them if
+    they are exceptions."""
+    responses = []
+
+    def head(url, headers, allow_redirects):
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr("pload.url_check.http_session.head", head)
+    return responses
+
+
+@pytest.mark.parametrize("status_code", [404, 410])
+def test_missing_files_are_cached(checker, responses, status_code):
+    responses.append(FakeResponse(status_code))
+
+    assert not checker.exists("http://example.com/a.mp3")
+    assert not checker.exists("http://example.com/a.mp3")
+    assert responses == []
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        FakeResponse(403),
+        FakeResponse(500),
+        FakeResponse(503),
+        requests.exceptions.ConnectTimeout(),
+        requests.exceptions.ConnectionError(),
+    ],
+)
+def test_transient_errors_are_not_cached(checker, responses, error):
+    responses.extend([error, FakeResponse(200)])
+
+    assert not checker.exists("http://example.com/a.mp3")
+    assert checker.exists("http://example.com/a.mp3")
+    assert responses == []
+
+
+def test_known_files_are_trusted_while_the_server_fails(checker, responses):
+    checker.ttl = 0
+    responses.extend(
+        [FakeResponse(200, {"ETag": '"1"'}), FakeResponse(503), FakeResponse(404)]
+    )
+
+    assert checker.exists("http://example.com/a.mp3")
+    assert checker.exists("http://example.com/a.mp3")
+    assert not checker.exists("http://example.com/a.mp3")
+    assert responses == []